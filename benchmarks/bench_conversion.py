@@ -0,0 +1,113 @@
+#!/usr/bin/python -tt
+
+# Copyright (c) NASK, NCSC
+#
+# This file is part of HoneySpider Network 2.1.
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Measures the per-attribute cost of converting objects between the internal format and ObjectData.
+Compares the current converters with the previous ones, which resolved the Type enum through
+hsn2enumwrapper for every attribute.
+Usage: bench_conversion.py [number of objects]
+'''
+
+import sys
+import time
+
+from hsn2_commons import hsn2enumwrapper as enumwrap
+from hsn2_commons import hsn2objectwrapper as ow
+from hsn2_protobuf import Object_pb2
+
+
+def legacyToObject(pbObject):
+    intObject = ow.Object(pbObject.id)
+    for attr in pbObject.attrs:
+        value_type = enumwrap.getName(attr, "Type", attr.type)
+        value_name = ow.types.get(value_type)
+        if value_name is not None:
+            value = getattr(attr, value_name)
+            if value_type == "BYTES":
+                intObject.addBytes(attr.name, attr.data_bytes.key, attr.data_bytes.store)
+                continue
+        else:
+            value = None
+        intObject.addAttribute(value_type, attr.name, value)
+    return intObject
+
+
+def legacyFromObject(intObject):
+    pbObject = Object_pb2.ObjectData()
+    objId = intObject.getObjectId()
+    if objId is not None:
+        pbObject.id = objId
+    for attr_name, value_type in intObject.getTypeStore().iteritems():
+        attr = pbObject.attrs.add()
+        attr.name = attr_name
+        attr.type = enumwrap.getValue(attr, "Type", value_type)
+        value_name = ow.types.get(value_type)
+        if value_name is not None:
+            if value_type == "BYTES":
+                (refKey, refStore) = getattr(intObject, attr_name).getBoth()
+                attr.data_bytes.key = refKey
+                if refStore is not None:
+                    attr.data_bytes.store = refStore
+            else:
+                setattr(attr, value_name, getattr(intObject, attr_name))
+    return pbObject
+
+
+def sampleObjects(count):
+    objects = []
+    for i in xrange(count):
+        obj = ow.Object(i + 1)
+        obj.addBytes("content", i, 1)
+        obj.addObject("parent", i)
+        obj.addString("type", "url")
+        obj.addString("url_original", "http://example.com/%d" % i)
+        obj.addInt("depth", 2)
+        obj.addTime("creation_time", 1400000000000)
+        obj.addBool("active", True)
+        obj.addFloat("score", 0.25)
+        obj.addFlag("processed")
+        objects.append(obj)
+    return objects
+
+
+def measure(function, items):
+    start = time.time()
+    for item in items:
+        function(item)
+    return time.time() - start
+
+
+def main(count):
+    objects = sampleObjects(count)
+    pbObjects = [ow.fromObject(obj) for obj in objects]
+    attrs = sum(len(pbObject.attrs) for pbObject in pbObjects)
+    print "%d objects, %d attributes" % (count, attrs)
+    print "%-12s %14s %14s %8s" % ("conversion", "legacy[us/attr]", "current[us/attr]", "speedup")
+    for (name, legacy, current, items) in [("toObject", legacyToObject, ow.toObject, pbObjects),
+                                           ("fromObject", legacyFromObject, ow.fromObject, objects)]:
+        # Warm up the enum caches of the legacy path.
+        legacy(items[0])
+        legacyTime = min(measure(legacy, items) for _ in range(3))
+        currentTime = min(measure(current, items) for _ in range(3))
+        print "%-12s %14.3f %14.3f %7.2fx" % (name, legacyTime * 1e6 / attrs, currentTime * 1e6 / attrs,
+                                              legacyTime / currentTime)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
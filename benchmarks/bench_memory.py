@@ -0,0 +1,100 @@
+#!/usr/bin/python -tt
+
+# Copyright (c) NASK, NCSC
+#
+# This file is part of HoneySpider Network 2.1.
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Measures the memory held by decoded objects with and without the shared table of attribute names.
+Each case runs in its own process, since the peak RSS of a process never goes down.
+Usage: bench_memory.py [number of objects]
+'''
+
+import gc
+import json
+import resource
+import subprocess
+import sys
+
+from hsn2_commons import hsn2objectwrapper as ow
+
+
+def sampleObject(i):
+    obj = ow.Object(i + 1)
+    obj.addBytes("content", i, 1)
+    obj.addObject("parent", i)
+    obj.addString("type", "url")
+    obj.addString("url_original", "http://example.com/%d" % i)
+    obj.addInt("depth", 2)
+    obj.addTime("creation_time", 1400000000000)
+    obj.addInt("job_id", 1)
+    obj.addInt("task_id", 2)
+    obj.addObject("top_ancestor", 1)
+    obj.addString("origin", "feeder")
+    obj.addFlag("processed")
+    obj.addInt("size", 5)
+    return obj
+
+
+def toJSON(obj):
+    attrs = []
+    for (name, hsn2type, value) in obj.iterAttributes():
+        attr = {"name": name, "type": hsn2type}
+        if hsn2type == "BYTES":
+            attr["data_bytes"] = {"key": value.getKey(), "store": value.getStore()}
+        elif ow.types.get(hsn2type) is not None:
+            attr[ow.types[hsn2type]] = value
+        attrs.append(attr)
+    return json.dumps({"id": obj.getObjectId(), "attrs": attrs})
+
+
+def measure(source, shared, count):
+    '''
+    @return: Bytes per decoded object.
+    '''
+    if not shared:
+        ow.maxAttributeNames = 0
+    if source == "ObjectData":
+        # Messages as they arrive from the object store, decoded one at a time.
+        encoded = [ow.fromObject(sampleObject(i)).SerializeToString() for i in xrange(count)]
+        decode = lambda data: ow.toObject(ow.Object_pb2.ObjectData.FromString(data))
+    else:
+        encoded = [toJSON(sampleObject(i)) for i in xrange(count)]
+        decode = ow.toObjectFromJSON
+    gc.collect()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    objects = [decode(data) for data in encoded]
+    gc.collect()
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (after - before) * 1024.0 / len(objects)
+
+
+def main(count):
+    print "%d objects with 12 attributes" % count
+    print "%-12s %16s %16s %8s" % ("source", "copied[B/obj]", "shared[B/obj]", "saved")
+    for source in ("ObjectData", "JSON"):
+        results = []
+        for shared in ("copied", "shared"):
+            output = subprocess.check_output([sys.executable, __file__, "--measure", source, shared, str(count)])
+            results.append(float(output))
+        print "%-12s %16.0f %16.0f %7.0f%%" % (source, results[0], results[1], 100 * (1 - results[1] / results[0]))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "--measure":
+        print measure(sys.argv[2], sys.argv[3] == "shared", int(sys.argv[4]))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
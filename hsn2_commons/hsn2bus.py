@@ -76,6 +76,40 @@ class Bus(object):
         raise NotImplementedError(
             "This method need to be implemented in an appropriate class!")
 
+    def publishCommand(self, dest, mtype, command, shardKey=None):
+        '''
+        Send a command which expects a reply without waiting for it.
+        The reply is to be collected with awaitResponse.
+        @param dest: The name of the destination. Only "fw" and "os" are supported.
+        @param mtype: The message type written as a string.
+        @param command: The message that is to be sent or its serialized form.
+        @param shardKey: Commands with equal keys go to the same queue if the destination has several.
+                         None means the queues are used in turn.
+        @return: The correlation id of the sent message.
+        '''
+        raise NotImplementedError(
+            "This method need to be implemented in an appropriate class!")
+
+    def awaitResponse(self, dest, corrIds, timeout):
+        '''
+        Wait for a reply to one of the previously published commands.
+        Replies with other correlation ids are discarded.
+        @param dest: The name of the destination the commands were sent to.
+        @param corrIds: Correlation ids of the commands for which a reply is accepted.
+        @param timeout: How long to wait for a reply.
+        @return: A tuple containing the correlation id, the message type and the message body in that order.
+        '''
+        raise NotImplementedError(
+            "This method need to be implemented in an appropriate class!")
+
+    def abandonResponses(self, corrIds):
+        '''
+        Marks replies to the given commands as no longer awaited, so they are dropped when they arrive.
+        @param corrIds: Correlation ids of the abandoned commands.
+        '''
+        raise NotImplementedError(
+            "This method need to be implemented in an appropriate class!")
+
     def _wait_for_response(self, queue, timeout=120):
         '''
         Wait for a message to appear on the queue.
@@ -20,13 +20,214 @@
 import httplib
 import os
 import re
+import socket
+import stat
 import tempfile
+import threading
+
+
+# Size of the pieces in which files are uploaded.
+uploadChunkSize = 65536
+# The key of an uploaded file is the last path segment of the reply, e.g. "/data/<job>/<key>?<query>".
+uploadedKey = re.compile(r'(?:^|/)([0-9]+)/?(?:[?#]\S*)?\s*$')
+# Replies in other formats fall back to the first number, as in earlier versions.
+anyNumber = re.compile(r'([0-9]+)')
 
 
 class DataStoreException(Exception):
     pass
 
 
+class ConnectionPool(object):
+    '''
+    Persistent HTTP/1.1 connections to one address, reused by consecutive requests.
+    Connections are never shared between processes: after a fork the child opens its own.
+    '''
+
+    def __init__(self, address, maxIdle=4):
+        '''
+        @param address: host:port of the server.
+        @param maxIdle: How many idle connections are kept open.
+        '''
+        self.address = address
+        self.maxIdle = maxIdle
+        self.lock = threading.Lock()
+        self.idle = list()
+        self.pid = os.getpid()
+        self.created = 0
+        self.reused = 0
+        self.reconnects = 0
+        self.requests = 0
+
+    def acquire(self):
+        '''
+        @return: A tuple containing a connection and True if it was used before.
+        '''
+        with self.lock:
+            self.requests = self.requests + 1
+            pid = os.getpid()
+            if pid != self.pid:
+                # The sockets are shared with the parent process, leave them to it.
+                self.idle = list()
+                self.pid = pid
+            if self.idle:
+                self.reused = self.reused + 1
+                return (self.idle.pop(), True)
+            self.created = self.created + 1
+        return (httplib.HTTPConnection(self.address), False)
+
+    def release(self, conn):
+        '''
+        Returns a connection whose response was read completely to the pool.
+        '''
+        with self.lock:
+            if self.pid == os.getpid() and len(self.idle) < self.maxIdle:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, path, body=None, headers=None, length=None):
+        '''
+        Sends a request and reads the whole response. A reused connection which turns out to be closed
+        by the server is replaced with a new one and the request is sent again. A file object body is
+        rewound for that, so if it isn't seekable (e.g. a pipe) DataStoreException is raised instead.
+        @param body: String or file object from which the body is read in chunks of uploadChunkSize.
+        @param length: The number of bytes sent from a file object. If None the file is sent until
+                       its end with chunked transfer encoding.
+        @return: A tuple containing the status, the reason, the headers and the body of the response.
+        '''
+        start = getRewindPosition(body) if hasattr(body, "read") else None
+        while True:
+            (conn, reused) = self.acquire()
+            answered = False
+            try:
+                if hasattr(body, "read"):
+                    self.sendStream(conn, method, path, body, headers or {}, length)
+                else:
+                    conn.request(method, path, body, headers or {})
+                response = conn.getresponse()
+                answered = True
+                data = response.read()
+            except (socket.error, httplib.HTTPException) as e:
+                conn.close()
+                if reused and not answered:
+                    if hasattr(body, "read"):
+                        self.rewind(body, start, e)
+                    with self.lock:
+                        self.reconnects = self.reconnects + 1
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self.release(conn)
+            return (response.status, response.reason, response.msg, data)
+
+    def rewind(self, body, start, error):
+        '''
+        Rewinds a file object to send it again after the connection was lost.
+        @raise DataStoreException: When the file object isn't seekable (e.g. a pipe).
+        '''
+        if start is not None:
+            try:
+                body.seek(start)
+                return
+            except (IOError, OSError, ValueError):
+                pass
+        raise DataStoreException("Connection to the data store lost (%s) and the uploaded stream "
+                                 "can't be rewound to send it again." % error)
+
+    def sendStream(self, conn, method, path, body, headers, length):
+        conn.putrequest(method, path)
+        for (name, value) in headers.iteritems():
+            conn.putheader(name, value)
+        if length is None:
+            conn.putheader("Transfer-Encoding", "chunked")
+        else:
+            conn.putheader("Content-Length", str(length))
+        conn.endheaders()
+        if length is None:
+            while True:
+                chunk = body.read(uploadChunkSize)
+                if not chunk:
+                    break
+                conn.send("%x\r\n%s\r\n" % (len(chunk), chunk))
+            conn.send("0\r\n\r\n")
+        else:
+            left = length
+            while left > 0:
+                chunk = body.read(min(left, uploadChunkSize))
+                if not chunk:
+                    raise IOError("File ended %d bytes before the declared length." % left)
+                conn.send(chunk)
+                left = left - len(chunk)
+
+    def clear(self):
+        '''
+        Closes the idle connections.
+        '''
+        with self.lock:
+            idle = self.idle if self.pid == os.getpid() else []
+            self.idle = list()
+        for conn in idle:
+            conn.close()
+
+    def getStats(self):
+        '''
+        @return: dict with the number of connections created, requests sent on reused connections,
+                 connections replaced after the server closed them, requests and idle connections.
+        '''
+        with self.lock:
+            return {
+                "created": self.created,
+                "reused": self.reused,
+                "reconnects": self.reconnects,
+                "requests": self.requests,
+                "idle": len(self.idle),
+            }
+
+
+# Connection pools shared by all adapters in the process, by address.
+connectionPools = dict()
+connectionPoolsLock = threading.Lock()
+
+
+def getRewindPosition(body):
+    '''
+    @param body: File object being uploaded.
+    @return: The position to which it can be rewound or None if it isn't seekable (e.g. pipes and sockets).
+    '''
+    if not hasattr(body, "seek") or not hasattr(body, "tell"):
+        return None
+    if hasattr(body, "seekable") and not body.seekable():
+        return None
+    try:
+        return body.tell()
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def getUploadedKey(reply):
+    '''
+    @param reply: The body of the reply of the data store to an upload.
+    @return: The last path segment if the reply is a path (optionally with a query) or a bare key,
+             otherwise the first number in the reply. None if there is no number.
+    '''
+    m = uploadedKey.search(reply) or anyNumber.search(reply)
+    return m.group(1) if m is not None else None
+
+
+def getConnectionPool(address):
+    with connectionPoolsLock:
+        pool = connectionPools.get(address)
+        if pool is None:
+            pool = connectionPools[address] = ConnectionPool(address)
+        return pool
+
+
 class HSN2DataStoreAdapter():
 
     def __init__(self, address):
@@ -37,45 +238,63 @@ class HSN2DataStoreAdapter():
         if address.startswith(prefix):
             address =  address[len(prefix):]
         self.address = address
+        self.pool = getConnectionPool(address)
+        # Contents and temporary files of references read during the current task, by (job_id, event_id).
+        self.cachedFiles = dict()
+        self.cachedPaths = dict()
 
     def putBytes(self, bytes_, job_id):
         '''
         Uploads a file to the HSN2 Data Store.
-        @param filepath: The file to be uploaded.
+        @param bytes_: The contents of the file to be uploaded.
         @param job_id: The id of the job in which the file is being uploaded.
         @return: The key under which the file is stored.
         '''
+        return self.postData(job_id, bytes_)
 
-        http = httplib.HTTP(self.address)
-        try:
-            # write header
-            http.putrequest("POST", "/data/" + str(job_id))
-            http.putheader("User-Agent", "python service")
-            http.putheader("Content-Length", str(len(bytes_)))
-            http.endheaders()
-
-            # write body
-            http.send(bytes_)
+    def putStream(self, fileobj, job_id, length=None):
+        '''
+        Uploads the contents of a file object to the HSN2 Data Store without reading it into memory.
+        @param fileobj: The file object from which the contents are read.
+        @param job_id: The id of the job in which the file is being uploaded.
+        @param length: The number of bytes to upload. If None the file object is read until its end
+                       and sent with chunked transfer encoding.
+        @return: The key under which the file is stored.
+        '''
+        return self.postData(job_id, fileobj, length)
 
-            # get response
-            errcode, errmsg, headers = http.getreply()
+    def putFile(self, filepath, job_id):
+        '''
+        Uploads a file to the HSN2 Data Store without reading it into memory.
+        @param filepath: The file to be uploaded.
+        @param job_id: The id of the job in which the file is being uploaded.
+        @return: The key under which the file is stored.
+        '''
+        with open(filepath, 'rb') as f:
+            fileStat = os.fstat(f.fileno())
+            # Sizes of pipes and devices are unknown.
+            length = fileStat.st_size if stat.S_ISREG(fileStat.st_mode) else None
+            return self.putStream(f, job_id, length)
 
-            if errcode != 201:
-                raise DataStoreException(
-                    "%d - %s - %s" % (errcode, errmsg, headers))
+    def postData(self, job_id, body, length=None):
+        '''
+        @return: The key from the reply, see getUploadedKey.
+        '''
+        try:
+            (errcode, errmsg, headers, result) = self.pool.request(
+                "POST", "/data/" + str(job_id), body, {"User-Agent": "python service"}, length)
         except Exception as e:
             raise DataStoreException(str(e))
+        if errcode != 201:
+            raise DataStoreException(
+                "%d - %s - %s" % (errcode, errmsg, headers))
 
-        result = http.getfile().read()
-
-        m = re.search('([0-9]+)', result)
-        return m.group(0)
+        key = getUploadedKey(result)
+        if key is None:
+            raise DataStoreException("No key in the reply of the data store: %r" % result[:100])
+        return key
         '''return new event id'''
 
-    def putFile(self, filepath, job_id):
-        data = open(filepath, 'rb').read()
-        return self.putBytes(data, job_id)
-
     def getFile(self, job_id, event_id):
         '''
         Downloads a file from the HSN2 Data Store and returns it's contents.
@@ -83,24 +302,16 @@ class HSN2DataStoreAdapter():
         @param event_id: The key under which the file is stored.
         @return: The contents of the file.
         '''
-        http = httplib.HTTP(self.address)
         try:
-            http.putrequest(
-                "GET", "/data/" + str(job_id) + "/" + str(event_id))
-            http.putheader("User-Agent", "python service")
-            http.endheaders()
-
-            http.send("")
-            errcode, errmsg, headers = http.getreply()
-
-            if errcode != 200:
-                raise DataStoreException(
-                    "U" + "%d - %s - %s" % (errcode, errmsg, headers))
+            (errcode, errmsg, headers, data) = self.pool.request(
+                "GET", "/data/" + str(job_id) + "/" + str(event_id), None, {"User-Agent": "python service"})
         except Exception as e:
             raise DataStoreException(str(e))
-            #raise DataStoreException(http.getfile().read())
+        if errcode != 200:
+            raise DataStoreException(
+                "U" + "%d - %s - %s" % (errcode, errmsg, headers))
 
-        return http.getfile().read()
+        return data
 
     def saveFile(self, job_id, event_id, filepath):
         '''
@@ -138,3 +349,56 @@ class HSN2DataStoreAdapter():
         '''
         if os.path.exists(filepath):
             os.remove(filepath)
+
+    def getCachedFile(self, job_id, event_id):
+        '''
+        Same as getFile, but the contents are downloaded only once until clearCache is called.
+        @param job_id: The id of the job in which the file was uploaded.
+        @param event_id: The key under which the file is stored.
+        @return: The contents of the file.
+        '''
+        key = (job_id, event_id)
+        data = self.cachedFiles.get(key)
+        if data is None:
+            path = self.cachedPaths.get(key)
+            if path is not None:
+                with open(path, "rb") as f:
+                    data = f.read()
+            else:
+                data = self.getFile(job_id, event_id)
+            self.cachedFiles[key] = data
+        return data
+
+    def getCachedPath(self, job_id, event_id):
+        '''
+        Same as saveTmp, but the file is saved only once and removed by clearCache.
+        @param job_id: The id of the job in which the file was uploaded.
+        @param event_id: The key under which the file is stored.
+        @return: The path to the file.
+        '''
+        key = (job_id, event_id)
+        path = self.cachedPaths.get(key)
+        if path is None:
+            data = self.cachedFiles.get(key)
+            if data is None:
+                data = self.getFile(job_id, event_id)
+            (fhandle, path) = tempfile.mkstemp(".tmp", prefix="ds", text=False)
+            os.write(fhandle, data)
+            os.close(fhandle)
+            self.cachedPaths[key] = path
+        return path
+
+    def clearCache(self):
+        '''
+        Forgets the cached contents and removes the temporary files of getCachedFile and getCachedPath.
+        '''
+        for path in self.cachedPaths.itervalues():
+            self.removeTmp(path)
+        self.cachedPaths = dict()
+        self.cachedFiles = dict()
+
+    def getPoolStats(self):
+        '''
+        @return: dict with the statistics of the connection pool used for the Data Store.
+        '''
+        return self.pool.getStats()
@@ -19,9 +19,104 @@
 This module serves as a wrapper for object attributes between HSN2 and protocol buffers.
 '''
 
-# used for storing name by value
-NameToNumber = dict()
-NumberToName = dict()
+from collections import Mapping, OrderedDict
+import importlib
+import pkgutil
+
+# Enumerations of the messages used so far, keyed by (full name of the message, name of the enumeration).
+# Keying by the message keeps enumerations with the same name in different messages apart.
+# Messages are registered on first use, so no _pb2 module is imported just to fill it.
+registry = OrderedDict()
+
+
+class EnumMap(object):
+    '''
+    Both directions of an enumeration.
+    '''
+    __slots__ = ('numbers', 'names')
+
+    def __init__(self, enumDescriptor):
+        # name -> number and number -> name; for aliased numbers the first name is kept.
+        self.numbers = dict()
+        self.names = dict()
+        for item in enumDescriptor.values:
+            self.numbers[item.name] = item.number
+            self.names.setdefault(item.number, item.name)
+
+
+class EnumView(Mapping):
+    '''
+    Read-only view of the registry keyed by the name of the enumeration only, as the former
+    NameToNumber and NumberToName dicts were. An enumeration with the same name in several
+    messages gives the one registered first.
+    '''
+
+    def __init__(self, direction):
+        '''
+        @param direction: "numbers" for name -> number maps, "names" for number -> name maps.
+        '''
+        self.direction = direction
+
+    def __getitem__(self, listName):
+        for ((_, name), enumMap) in registry.iteritems():
+            if name == listName:
+                return getattr(enumMap, self.direction)
+        raise KeyError(listName)
+
+    def __iter__(self):
+        return iter(OrderedDict.fromkeys(name for (_, name) in registry))
+
+    def __len__(self):
+        return len(set(name for (_, name) in registry))
+
+
+# Kept for compatibility, they only show the enumerations registered so far.
+NameToNumber = EnumView("numbers")
+NumberToName = EnumView("names")
+
+
+def registerMessage(descriptor):
+    '''
+    Adds the enumerations of a message and its nested messages to the registry.
+    @param descriptor: The descriptor of the message.
+    '''
+    for enumDescriptor in descriptor.enum_types:
+        registry[(descriptor.full_name, enumDescriptor.name)] = EnumMap(enumDescriptor)
+    for nested in descriptor.nested_types:
+        registerMessage(nested)
+
+
+def registerModule(module):
+    '''
+    Adds the enumerations of all messages of a generated _pb2 module to the registry.
+    '''
+    for descriptor in module.DESCRIPTOR.message_types_by_name.values():
+        registerMessage(descriptor)
+
+
+def registerPackage(package):
+    '''
+    Adds the enumerations of all _pb2 modules of a package (e.g. hsn2_protobuf) to the registry.
+    All the modules are imported, so it's only worth it when most of them are used anyway.
+    '''
+    for (_, name, isPackage) in pkgutil.iter_modules(package.__path__):
+        if not isPackage and name.endswith("_pb2"):
+            registerModule(importlib.import_module(package.__name__ + "." + name))
+
+
+def getEnum(obj, listName):
+    '''
+    Retrieve both directions of an enumeration, for lookups in loops.
+    @param obj: The message (or message class) for which the enum is defined.
+    @param listName: The name of the enumeration.
+    @return: EnumMap of the enumeration.
+    '''
+    descriptor = obj.DESCRIPTOR
+    enumMap = registry.get((descriptor.full_name, listName))
+    if enumMap is None:
+        registerMessage(descriptor)
+        enumMap = registry[(descriptor.full_name, listName)]
+    return enumMap
 
 
 def getName(obj, listName, val):
@@ -32,8 +127,7 @@ def getName(obj, listName, val):
     @param val: The value for which to retrieve the name.
     @return: String name of the enumeration item.
     '''
-    loadList(obj, listName)
-    return NumberToName.get(listName).get(val)
+    return getEnum(obj, listName).names.get(val)
 
 
 def getValue(obj, listName, key):
@@ -44,19 +138,14 @@ def getValue(obj, listName, key):
     @param key: The name for which to retrieve the value.
     @return: integer value of the enumeration item.
     '''
-    loadList(obj, listName)
-    return NameToNumber.get(listName).get(key)
+    return getEnum(obj, listName).numbers.get(key)
 
 
 def loadList(obj, listName):
     '''
-    Load the enumeration list into memory.
+    Load the enumeration list into memory. Kept for compatibility, getName and getValue load it on first use.
     @param obj: The object for which the enum value is defined.
     @param listName: The enumeration list in which the value appears.
+    @return: EnumMap of the enumeration.
     '''
-    if NameToNumber.get(listName) is None:
-        NameToNumber[listName] = dict(
-            [(item.name, item.number) for item in obj.DESCRIPTOR.enum_types_by_name[listName].values])
-    if NumberToName.get(listName) is None:
-        NumberToName[listName] = dict(
-            zip(NameToNumber[listName].values(), NameToNumber[listName].keys()))
+    return getEnum(obj, listName)
@@ -0,0 +1,352 @@
+# Copyright (c) NASK, NCSC
+#
+# This file is part of HoneySpider Network 2.1.
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Column-wise storage of many objects, for reports and filters over whole jobs.
+
+Each attribute name becomes a column holding one value per object (row) in a typed array,
+with a zero in the rows in which the attribute isn't set. Strings are interned in a table
+shared by the batch and their columns hold indexes into it.
+
+Filters return selections, which are python longs with bit i set when row i matches.
+They can be combined with &, | and ~. The methods of ObjectBatch taking selections mask them
+with ObjectBatch.all(), so the negative longs made by ~ select only existing rows.
+Example:
+    sel = batch.has("active") & batch.where("depth", ">", 3)
+    ids = batch.getIds(sel)
+'''
+
+from array import array
+from itertools import repeat
+import operator
+
+from hsn2_commons import hsn2objectwrapper as ow
+from hsn2_commons.hsn2objectwrapper import BadValueException
+
+# Typecodes of the arrays holding values of each attribute type. EMPTY needs no values.
+# STRING holds indexes into the string table, BYTES holds the keys (the stores are kept separately).
+# Times can be negative (before the epoch), object ids and data store keys can't.
+typeCodes = {
+    'BOOL': 'b',
+    'INT': 'l',
+    'FLOAT': 'd',
+    'TIME': 'l',
+    'STRING': 'l',
+    'BYTES': 'L',
+    'OBJECT': 'L',
+}
+
+operators = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+# Translates a string of 0/1 bytes to a string of '0'/'1' digits.
+bitDigits = '0' + '1' * 255
+
+
+def toSelection(flags):
+    '''
+    @param flags: bytearray or string with a non-zero byte for each selected row.
+    @return: python long with bit i set when byte i is non-zero.
+    '''
+    digits = str(flags).translate(bitDigits)[::-1]
+    if not digits:
+        return 0
+    return int(digits, 2)
+
+
+def iterRows(selection):
+    '''
+    @param selection: Non-negative selection, e.g. masked with ObjectBatch.all().
+    @return: iterator over the indexes of the rows in the selection.
+    '''
+    if selection < 0:
+        raise BadValueException("Negative selection, it has to be masked with ObjectBatch.all().")
+    bits = bin(selection)[:1:-1]
+    return (row for (row, bit) in enumerate(bits) if bit == '1')
+
+
+class Column(object):
+    '''
+    Values of one attribute in all rows of a batch.
+    '''
+    __slots__ = ('name', 'hsn2type', 'present', 'values', 'stores', 'otherKeys', 'presentSel')
+
+    def __init__(self, name, hsn2type):
+        self.name = name
+        self.hsn2type = hsn2type
+        self.present = bytearray()
+        code = typeCodes.get(hsn2type)
+        self.values = array(code) if code is not None else None
+        self.stores = array('l') if hsn2type == 'BYTES' else None
+        # BYTES keys which don't fit the array (e.g. strings given to addBytes2) by row.
+        self.otherKeys = dict() if hsn2type == 'BYTES' else None
+        self.presentSel = None
+
+    def pad(self, rows):
+        '''
+        Fills the rows up to (excluding) rows in which the attribute isn't set.
+        '''
+        gap = rows - len(self.present)
+        if gap > 0:
+            self.present.extend(repeat(0, gap))
+            if self.values is not None:
+                self.values.extend(repeat(0, gap))
+            if self.stores is not None:
+                self.stores.extend(repeat(0, gap))
+
+    def setRow(self, row, value, store=0):
+        '''
+        Sets the attribute in a row, which is either the last row or a new one.
+        An attribute repeated in one object is set again, the last value wins as in toObject.
+        @param store: The store of a BYTES value.
+        '''
+        if row < len(self.present):
+            self.present[row] = 1
+            if self.values is not None:
+                self.values[row] = value
+            if self.stores is not None:
+                self.stores[row] = store
+        else:
+            self.pad(row)
+            self.present.append(1)
+            if self.values is not None:
+                self.values.append(value)
+            if self.stores is not None:
+                self.stores.append(store)
+        self.presentSel = None
+
+    def getSelection(self):
+        if self.presentSel is None:
+            self.presentSel = toSelection(self.present)
+        return self.presentSel
+
+
+class ObjectBatch(object):
+    '''
+    Objects stored column-wise. Rows are numbered in the order in which objects were added.
+    '''
+
+    def __init__(self):
+        self.ids = array('L')
+        self.columns = dict()
+        self.strings = list()
+        self.stringIndex = dict()
+
+    @classmethod
+    def fromResponse(cls, objResp):
+        '''
+        @param objResp: ObjectResponse (or any sequence of ObjectData messages).
+        @return: ObjectBatch with the objects carried by the response.
+        '''
+        batch = cls()
+        batch.addPbObjects(getattr(objResp, "data", objResp))
+        return batch
+
+    @classmethod
+    def fromObjects(cls, objects):
+        '''
+        @param objects: Iterable of objects in internal format.
+        @return: ObjectBatch with the objects.
+        '''
+        batch = cls()
+        for obj in objects:
+            batch.addAttributes(obj.getObjectId(), obj.iterAttributes())
+        return batch
+
+    @classmethod
+    def fromJSON(cls, jsonDump, ignoreIds=False):
+        '''
+        @param jsonDump: The unicorn dump from which objects will be loaded (path or file object, optionally gzipped).
+        @param ignoreIds: If True object ids will be ignored.
+        @return: ObjectBatch with the objects of the dump.
+        '''
+        return cls.fromObjects(ow.iterObjectsFromJSON(jsonDump, ignoreIds))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def addPbObjects(self, pbObjects):
+        '''
+        Adds ObjectData messages without creating objects in internal format.
+        '''
+        decoders = ow.typeDecoders
+        for pbObject in pbObjects:
+            attributes = list()
+            for attr in pbObject.attrs:
+                decoder = decoders.get(attr.type)
+                if decoder is None:
+                    raise BadValueException("Unknown attribute type: %s" % attr.type)
+                attributes.append((attr.name, decoder[0], decoder[1](attr)))
+            self.addAttributes(pbObject.id, attributes)
+
+    def addAttributes(self, ident, attributes):
+        '''
+        Adds a row.
+        @param ident: The object id (None is stored as 0).
+        @param attributes: Iterable of (name, type, value) tuples.
+        '''
+        row = len(self.ids)
+        self.ids.append(ident or 0)
+        for (name, hsn2type, value) in attributes:
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = Column(name, hsn2type)
+            elif column.hsn2type != hsn2type:
+                raise BadValueException("Attribute '%s' is %s in object %s but was %s before." %
+                                        (name, hsn2type, ident, column.hsn2type))
+            if hsn2type == 'STRING':
+                value = self.internString(value)
+            elif hsn2type == 'BYTES':
+                key = value.getKey()
+                column.otherKeys.pop(row, None)
+                if not isinstance(key, (int, long)) or key < 0:
+                    column.otherKeys[row] = key
+                    key = 0
+                column.setRow(row, key, value.getStore() or 0)
+                continue
+            elif hsn2type == 'BOOL':
+                value = int(value)
+            column.setRow(row, value)
+
+    def internString(self, value):
+        index = self.stringIndex.get(value)
+        if index is None:
+            index = self.stringIndex[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def getColumn(self, name):
+        '''
+        @return: The column padded to all rows of the batch.
+        '''
+        column = self.columns.get(name)
+        if column is None:
+            raise KeyError(name)
+        column.pad(len(self.ids))
+        return column
+
+    def getColumnNames(self):
+        return self.columns.keys()
+
+    def all(self):
+        '''
+        @return: Selection of all rows.
+        '''
+        return (1 << len(self.ids)) - 1
+
+    def iterRows(self, selection):
+        '''
+        @return: iterator over the indexes of the selected rows. Rows beyond the batch aren't selected.
+        '''
+        return iterRows(selection & self.all())
+
+    def has(self, name):
+        '''
+        @return: Selection of the rows in which the attribute is set (e.g. objects with a flag).
+        '''
+        if name not in self.columns:
+            return 0
+        return self.getColumn(name).getSelection()
+
+    def where(self, name, op, value):
+        '''
+        @param name: The attribute compared.
+        @param op: One of ==, !=, <, <=, >, >=.
+        @param value: The value to which the attribute is compared.
+        @return: Selection of the rows in which the attribute is set and the comparison is true.
+        '''
+        if name not in self.columns:
+            return 0
+        compare = operators[op]
+        column = self.getColumn(name)
+        if column.hsn2type == 'STRING':
+            matching = set(i for (i, string) in enumerate(self.strings) if compare(string, value))
+            flags = bytearray(map(matching.__contains__, column.values))
+        elif column.values is not None and column.hsn2type != 'BYTES':
+            flags = bytearray(map(compare, column.values, repeat(value, len(column.values))))
+        else:
+            raise BadValueException("Attribute '%s' of type %s can't be compared." % (name, column.hsn2type))
+        return toSelection(flags) & column.getSelection()
+
+    def count(self, selection):
+        return bin(selection & self.all()).count('1')
+
+    def getRows(self, selection):
+        return list(self.iterRows(selection))
+
+    def getIds(self, selection=None):
+        '''
+        @return: List of the ids of the selected objects (all when selection is None).
+        '''
+        if selection is None:
+            return self.ids.tolist()
+        ids = self.ids
+        return [ids[row] for row in self.iterRows(selection)]
+
+    def getValue(self, row, name, default=None):
+        '''
+        @return: The value of the attribute in the row or default if it isn't set.
+        '''
+        column = self.columns.get(name)
+        if column is None or row >= len(column.present) or not column.present[row]:
+            return default
+        if column.hsn2type == 'STRING':
+            return self.strings[column.values[row]]
+        elif column.hsn2type == 'BYTES':
+            key = column.otherKeys.get(row, column.values[row])
+            return ow.Reference(key, column.stores[row] or None)
+        elif column.hsn2type == 'BOOL':
+            return bool(column.values[row])
+        elif column.values is None:
+            return None
+        return column.values[row]
+
+    def getValues(self, name, selection=None):
+        '''
+        @return: List of the values of the attribute in the selected rows in which it is set.
+        '''
+        if name not in self.columns:
+            return []
+        if selection is None:
+            selection = self.has(name)
+        else:
+            selection = selection & self.has(name)
+        return [self.getValue(row, name) for row in self.iterRows(selection)]
+
+    def getObject(self, row):
+        '''
+        @return: The object in the row in internal format.
+        '''
+        obj = ow.Object(self.ids[row])
+        for column in self.columns.itervalues():
+            if row < len(column.present) and column.present[row]:
+                obj.addAttribute(column.hsn2type, column.name, self.getValue(row, column.name))
+        return obj
+
+    def iterObjects(self, selection=None):
+        '''
+        @return: iterator over the selected objects in internal format.
+        '''
+        if selection is None:
+            selection = self.all()
+        return (self.getObject(row) for row in self.iterRows(selection))
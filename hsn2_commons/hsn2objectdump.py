@@ -0,0 +1,310 @@
+# Copyright (c) NASK, NCSC
+#
+# This file is part of HoneySpider Network 2.1.
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Binary dump of objects: a stream of serialized ObjectData messages.
+
+Layout of the file:
+    header      - the 8 bytes of dumpMagic
+    records     - for every object a 4 byte little endian length followed by the ObjectData
+    end marker  - a record length of 0
+    index       - optional: for every object with an id (sorted by id) 8 bytes of id and 8 bytes of
+                  the record offset, followed by 8 bytes of the index offset, 8 bytes of the number
+                  of entries and the 8 bytes of indexMagic
+Since the end marker is zeros, a file without index never ends with indexMagic.
+'''
+
+from bisect import bisect_left
+import io
+import mmap
+import os
+import stat
+import struct
+
+from hsn2_commons import hsn2objectwrapper as ow
+from hsn2_protobuf import Object_pb2
+
+dumpMagic = 'HSN2OBJ1'
+indexMagic = 'HSN2IDX1'
+recordLength = struct.Struct('<I')
+indexEntry = struct.Struct('<QQ')
+indexTrailer = struct.Struct('<QQ8s')
+
+
+class ObjectDumpException(Exception):
+    pass
+
+
+class ObjectDumpWriter(object):
+    '''
+    Writes objects to a binary dump.
+    '''
+
+    def __init__(self, dump, index=True):
+        '''
+        @param dump: Path or file object to which the dump is written.
+        @param index: If True an index by object id is written when the writer is closed.
+        '''
+        self.ownsFile = isinstance(dump, basestring)
+        self.dumpFile = open(dump, 'wb') if self.ownsFile else dump
+        self.index = list() if index else None
+        self.offset = 0
+        self.count = 0
+        self.writeRaw(dumpMagic)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def writeRaw(self, data):
+        self.dumpFile.write(data)
+        self.offset = self.offset + len(data)
+
+    def write(self, obj):
+        '''
+        @param obj: Object in internal format or ObjectData.
+        '''
+        if not isinstance(obj, Object_pb2.ObjectData):
+            obj = ow.fromObject(obj)
+        data = obj.SerializeToString()
+        if self.index is not None and obj.HasField("id"):
+            self.index.append((obj.id, self.offset))
+        self.writeRaw(recordLength.pack(len(data)))
+        self.writeRaw(data)
+        self.count = self.count + 1
+
+    def writeMany(self, objects):
+        for obj in objects:
+            self.write(obj)
+
+    def close(self):
+        if self.dumpFile is None:
+            return
+        self.writeRaw(recordLength.pack(0))
+        if self.index is not None:
+            self.index.sort()
+            indexOffset = self.offset
+            for entry in self.index:
+                self.writeRaw(indexEntry.pack(*entry))
+            self.writeRaw(indexTrailer.pack(indexOffset, len(self.index), indexMagic))
+        if self.ownsFile:
+            self.dumpFile.close()
+        else:
+            self.dumpFile.flush()
+        self.dumpFile = None
+
+
+def mapFile(dumpFile):
+    '''
+    Memory maps a regular, non-empty file read from its start.
+    @param dumpFile: File object of the dump.
+    @return: The mmap or None if the file can't be mapped and has to be read sequentially
+             (e.g. StringIO, GzipFile or a pipe).
+    '''
+    # GzipFile and similar wrappers have the fileno of the underlying file, so only plain files qualify.
+    if not isinstance(dumpFile, (file, io.FileIO, io.BufferedReader)):
+        return None
+    try:
+        fileno = dumpFile.fileno()
+        fileStat = os.fstat(fileno)
+        if not stat.S_ISREG(fileStat.st_mode) or fileStat.st_size == 0 or dumpFile.tell() != 0:
+            return None
+        return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (ValueError, EnvironmentError):
+        return None
+
+
+class ObjectDumpReader(object):
+    '''
+    Reads objects from a binary dump. Regular files are memory mapped, other file objects are read sequentially.
+    '''
+
+    def __init__(self, dump, useMmap=True):
+        '''
+        @param dump: Path or file object of the dump.
+        @param useMmap: If False the file is read with regular reads, even if it could be mapped.
+        '''
+        self.ownsFile = isinstance(dump, basestring)
+        self.dumpFile = open(dump, 'rb') if self.ownsFile else dump
+        self.buf = None
+        self.indexOffset = None
+        self.indexCount = 0
+        if useMmap:
+            self.buf = mapFile(self.dumpFile)
+        if self.buf is not None:
+            header = self.buf[:len(dumpMagic)]
+        else:
+            header = self.dumpFile.read(len(dumpMagic))
+        if header != dumpMagic:
+            self.close()
+            raise ObjectDumpException("Not an object dump.")
+        if self.buf is not None:
+            self.readIndex()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def readIndex(self):
+        end = len(self.buf)
+        if end < len(dumpMagic) + recordLength.size + indexTrailer.size:
+            return
+        (indexOffset, indexCount, magic) = indexTrailer.unpack_from(self.buf, end - indexTrailer.size)
+        if magic != indexMagic:
+            return
+        if indexOffset + indexCount * indexEntry.size + indexTrailer.size != end:
+            raise ObjectDumpException("Corrupted index.")
+        self.indexOffset = indexOffset
+        self.indexCount = indexCount
+
+    def hasIndex(self):
+        return self.indexOffset is not None
+
+    def iterPbObjects(self):
+        '''
+        @return: generator yielding ObjectData messages in the order in which they were written.
+        '''
+        if self.buf is not None:
+            buf = self.buf
+            pos = len(dumpMagic)
+            while True:
+                if pos + recordLength.size > len(buf):
+                    raise ObjectDumpException("Dump is truncated.")
+                (length,) = recordLength.unpack_from(buf, pos)
+                if length == 0:
+                    return
+                pos = pos + recordLength.size
+                if pos + length > len(buf):
+                    raise ObjectDumpException("Dump is truncated.")
+                yield Object_pb2.ObjectData.FromString(buf[pos:pos + length])
+                pos = pos + length
+        else:
+            read = self.dumpFile.read
+            while True:
+                header = read(recordLength.size)
+                if len(header) < recordLength.size:
+                    raise ObjectDumpException("Dump is truncated.")
+                (length,) = recordLength.unpack(header)
+                if length == 0:
+                    return
+                data = read(length)
+                if len(data) < length:
+                    raise ObjectDumpException("Dump is truncated.")
+                yield Object_pb2.ObjectData.FromString(data)
+
+    def iterObjects(self, lazy=False):
+        '''
+        @param lazy: If True LazyObject views are returned, which decode attributes on first access.
+        @return: generator yielding objects in internal format.
+        '''
+        convert = ow.LazyObject if lazy else ow.toObject
+        for pbObject in self.iterPbObjects():
+            yield convert(pbObject)
+
+    def getIds(self):
+        '''
+        @return: Sorted list of the ids in the index.
+        '''
+        self.checkIndex()
+        return [indexEntry.unpack_from(self.buf, self.indexOffset + i * indexEntry.size)[0]
+                for i in xrange(self.indexCount)]
+
+    def getPbObject(self, objectId):
+        '''
+        @return: The ObjectData with the given id or None if it isn't in the dump.
+        '''
+        self.checkIndex()
+        i = bisect_left(IndexKeys(self), objectId)
+        if i == self.indexCount:
+            return None
+        (ident, offset) = indexEntry.unpack_from(self.buf, self.indexOffset + i * indexEntry.size)
+        if ident != objectId:
+            return None
+        (length,) = recordLength.unpack_from(self.buf, offset)
+        offset = offset + recordLength.size
+        return Object_pb2.ObjectData.FromString(self.buf[offset:offset + length])
+
+    def getObject(self, objectId, lazy=False):
+        '''
+        @return: The object with the given id in internal format or None if it isn't in the dump.
+        '''
+        pbObject = self.getPbObject(objectId)
+        if pbObject is None:
+            return None
+        return ow.LazyObject(pbObject) if lazy else ow.toObject(pbObject)
+
+    def checkIndex(self):
+        if self.indexOffset is None:
+            raise ObjectDumpException("Dump has no index or isn't memory mapped.")
+
+    def close(self):
+        if self.buf is not None:
+            self.buf.close()
+            self.buf = None
+        if self.dumpFile is not None and self.ownsFile:
+            self.dumpFile.close()
+        self.dumpFile = None
+
+
+class IndexKeys(object):
+    '''
+    Sequence view of the ids in the index of a memory mapped dump, for bisect.
+    '''
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __len__(self):
+        return self.reader.indexCount
+
+    def __getitem__(self, i):
+        return indexEntry.unpack_from(self.reader.buf, self.reader.indexOffset + i * indexEntry.size)[0]
+
+
+def writeObjects(dump, objects, index=True):
+    '''
+    Writes objects to a binary dump.
+    @param dump: Path or file object to which the dump is written.
+    @param objects: Iterable of objects in internal format or ObjectData messages.
+    @param index: If True an index by object id is written.
+    @return: The number of objects written.
+    '''
+    writer = ObjectDumpWriter(dump, index)
+    try:
+        writer.writeMany(objects)
+    finally:
+        writer.close()
+    return writer.count
+
+
+def iterObjects(dump, lazy=False):
+    '''
+    Reads objects from a binary dump.
+    @param dump: Path or file object of the dump.
+    @param lazy: If True LazyObject views are returned, which decode attributes on first access.
+    @return: generator yielding objects in internal format.
+    '''
+    reader = ObjectDumpReader(dump)
+    try:
+        for obj in reader.iterObjects(lazy):
+            yield obj
+    finally:
+        reader.close()
@@ -17,7 +17,22 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from hsn2_commons import hsn2enumwrapper as enumwrap
+from collections import MutableMapping, deque
+from itertools import imap, islice, izip
+from operator import attrgetter
+import copy_reg
+import io
+import json
+import marshal
+import mmap
+import multiprocessing
+import os
+import re
+import stat
+import time
+import zlib
+from cStringIO import StringIO
+
 from hsn2_protobuf import Object_pb2
 from hsn2_protobuf import Resources_pb2
 
@@ -25,6 +40,10 @@ from hsn2_protobuf import Resources_pb2
 class BadValueException(ValueError):
     pass
 
+jsonWhitespace = re.compile(r'\s*')
+gzipMagic = '\x1f\x8b'
+dumpBoundary = re.compile(r'\}\s*(\{)\s*"\w+"\s*:')
+
 types = {
     'EMPTY': None,
     'BOOL': 'data_bool',
@@ -37,15 +56,86 @@ types = {
 }
 
 
-def toObjects(several):
+def decodeReference(attr):
+    ref = attr.data_bytes
+    return Reference(long(ref.key), int(ref.store))
+
+
+def buildTypeTables():
+    '''
+    Resolves the attribute Type enum of the protocol once.
+    @return: A tuple of two dicts: type number -> (type name, value decoder)
+             and type name -> (type number, value field name).
+    '''
+    attrDescriptor = Object_pb2.ObjectData.DESCRIPTOR.fields_by_name['attrs'].message_type
+    decoders = dict()
+    encoders = dict()
+    for item in attrDescriptor.enum_types_by_name['Type'].values:
+        value_name = types.get(item.name)
+        if value_name is None:
+            decode = lambda attr: None
+        elif item.name == "BYTES":
+            decode = decodeReference
+        else:
+            decode = attrgetter(value_name)
+        decoders[item.number] = (item.name, decode)
+        encoders[item.name] = (item.number, value_name)
+    return (decoders, encoders)
+
+(typeDecoders, typeEncoders) = buildTypeTables()
+bytesType = typeEncoders["BYTES"][0]
+
+# Attribute names shared by all decoded objects. Its size is limited in case of objects with random names.
+attributeNames = dict()
+maxAttributeNames = 65536
+
+
+def internName(name):
+    '''
+    Returns the shared copy of an attribute name, so that decoded objects don't each keep their own.
+    @param name: The attribute name (str or unicode).
+    @return: An equal string, the same instance for all objects.
+    '''
+    interned = attributeNames.get(name)
+    if interned is None:
+        if len(attributeNames) >= maxAttributeNames:
+            return name
+        interned = attributeNames[name] = name
+    return interned
+
+# Dictionaries mapping attribute names to their positions, shared by all objects with the same names.
+# They must not be modified. The number of kept dictionaries is limited like attributeNames.
+attributeIndexes = dict()
+maxAttributeIndexes = 4096
+
+
+def getAttributeIndex(names):
+    '''
+    @param names: The attribute names of an object, in order.
+    @return: dict mapping the names to their positions.
+    '''
+    key = tuple(names)
+    index = attributeIndexes.get(key)
+    if index is None:
+        index = dict((name, i) for (i, name) in enumerate(key))
+        if len(attributeIndexes) < maxAttributeIndexes:
+            attributeIndexes[key] = index
+    return index
+
+
+def toObjects(several, lazy=False):
     '''
     Process a list of objects from the external format to the internal one.
     @param several: List of external objects to be converted.
+    @param lazy: If True LazyObject views are returned, which decode attributes on first access.
     @return: List of internal objects.
     '''
     retObjs = list()
     for item in several:
-        retObjs.append(toObject(item))
+        if lazy:
+            retObjs.append(LazyObject(item))
+        else:
+            retObjs.append(toObject(item))
     return retObjs
 
 
@@ -61,10 +151,30 @@ def fromObjects(several):
     return retObjs
 
 
-class Reference():
+# Bindings of references to data store adapters: id(reference) -> (reference, dsAdapter, jobId).
+# They are kept apart from Reference, so that unbound references stay small.
+referenceBindings = dict()
+
+
+def unbindReferences(dsAdapter=None):
+    '''
+    Drops the bindings of references, so that they and the adapter can be freed.
+    @param dsAdapter: Only references bound to this adapter are unbound. All of them if None.
+    '''
+    if dsAdapter is None:
+        referenceBindings.clear()
+        return
+    for (key, binding) in referenceBindings.items():
+        if binding[1] is dsAdapter:
+            referenceBindings.pop(key, None)
+
+
+class Reference(object):
     '''
     Class for storing references to Data Store objects.
+    A reference bound to a data store adapter and a job can fetch the contents it points to.
     '''
+    __slots__ = ('key', 'store')
 
     def __init__(self, key, store):
         self.key = key
@@ -88,20 +198,170 @@ class Reference():
     def setBoth(self, key, store):
         (self.key, self.store) = (key, store)
 
+    def __reduce__(self):
+        return (Reference, (self.key, self.store))
+
     def __str__(self):
         return str(self.getStore()) + "|" + str(self.getKey())
 
+    def bind(self, dsAdapter, jobId):
+        '''
+        The binding is kept until unbindReferences is called for the adapter.
+        @param dsAdapter: HSN2DataStoreAdapter from which the contents will be fetched.
+        @param jobId: The id of the job in which the contents were uploaded.
+        @return: The reference itself.
+        '''
+        referenceBindings[id(self)] = (self, dsAdapter, jobId)
+        return self
 
-class Object():
+    def isBound(self):
+        return id(self) in referenceBindings
+
+    def checkBound(self):
+        '''
+        @return: Tuple (dsAdapter, jobId) the reference is bound to.
+        '''
+        binding = referenceBindings.get(id(self))
+        if binding is None:
+            raise BadValueException("Reference %s isn't bound to a data store." % self)
+        return binding[1:]
+
+    def read(self):
+        '''
+        Fetches the contents on first use. They are cached by the data store adapter until its cache is cleared.
+        @return: The contents the reference points to.
+        '''
+        (dsAdapter, jobId) = self.checkBound()
+        return dsAdapter.getCachedFile(jobId, self.key)
+
+    def path(self):
+        '''
+        @return: The path to a temporary file with the contents. It is removed when the adapter's cache is cleared.
+        '''
+        (dsAdapter, jobId) = self.checkBound()
+        return dsAdapter.getCachedPath(jobId, self.key)
+
+    def stream(self):
+        '''
+        The contents aren't streamed from the data store: they are downloaded whole to a temporary file first
+        (see path), unless they were already read into memory.
+        @return: File object reading the contents.
+        '''
+        (dsAdapter, jobId) = self.checkBound()
+        data = dsAdapter.cachedFiles.get((jobId, self.key))
+        if data is not None:
+            return StringIO(data)
+        return open(self.path(), 'rb')
+
+
+class TypeStore(MutableMapping):
+    '''
+    Dictionary view of the attribute types of an object. Changes made through it change the object.
+    '''
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __getitem__(self, name):
+        return self.obj.getAttributeType(name)
+
+    def __setitem__(self, name, hsn2type):
+        self.obj.setType(name, hsn2type)
+
+    def __delitem__(self, name):
+        try:
+            self.obj.removeAttribute(name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __iter__(self):
+        return iter(self.obj.getAttributeNames())
+
+    def __len__(self):
+        return len(self.obj.getAttributeNames())
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+
+class Object(object):
     '''
     Class for internal representation of HSN2 objects.
+    Attributes are kept in parallel lists of names, types and values
+    and are available as regular python attributes of the object.
+    Other python attributes can be set as well, they are kept in __dict__ and aren't sent to the object store.
+    Clones keep tuples shared with their template instead, until they are modified.
     '''
-    internalStoreType = None
-    internalStoreId = None
+    __slots__ = ('internalStoreId', '_names', '_types', '_values', '_template', '_index', '_extra', '__dict__')
 
     def __init__(self, ident=None):
         self.internalStoreId = ident
-        self.internalStoreType = dict()
+        self._names = []
+        self._types = []
+        self._values = []
+        self._template = None
+        # Shared name -> position dict, built on first lookup by name.
+        self._index = None
+        # True once a python attribute other than an HSN2 attribute was set.
+        self._extra = False
+
+    def __getattr__(self, name):
+        # Only called for names which aren't slots, methods or in __dict__.
+        if name.startswith('_'):
+            raise AttributeError(name)
+        # Same as findAttribute, inlined.
+        index = self._index
+        if index is None:
+            index = getAttributeIndex(self._names)
+            setIndexSlot(self, index)
+        i = index.get(name)
+        if i is None:
+            raise AttributeError(name)
+        return self._values[i]
+
+    def __setattr__(self, name, value):
+        if hasattr(self.__class__, name):
+            object.__setattr__(self, name, value)
+        elif name.startswith('_') or not self.hasAttribute(name):
+            # Not an HSN2 attribute, kept in __dict__ like in any python object.
+            setExtraSlot(self, True)
+            object.__setattr__(self, name, value)
+        else:
+            self.setValue(name, value)
+
+    def __delattr__(self, name):
+        if hasattr(self.__class__, name) or name.startswith('_') or not self.hasAttribute(name):
+            object.__delattr__(self, name)
+        else:
+            self.removeAttribute(name)
+
+    def __reduce__(self):
+        # A flat tuple pickles much smaller and faster than a list of attribute tuples.
+        args = (self.internalStoreId, tuple(self._names), tuple(self._types), tuple(self._values), type(self))
+        state = getExtraState(self)
+        if state is None:
+            return (restoreObject, args)
+        return (restoreObject, args, (None, state))
+
+    @property
+    def internalStoreType(self):
+        return self.getTypeStore()
+
+    @internalStoreType.setter
+    def internalStoreType(self, types):
+        '''
+        Replaces the types of all attributes, as assigning the dict of types used to.
+        Attributes missing from types stop being HSN2 attributes, their values are kept as python attributes.
+        '''
+        types = dict(types)
+        for name in self.getAttributeNames():
+            if name not in types:
+                value = getattr(self, name)
+                self.removeAttribute(name)
+                setExtraSlot(self, True)
+                object.__setattr__(self, name, value)
+        for (name, hsn2type) in types.iteritems():
+            self.setType(name, hsn2type)
 
     def setObjectId(self, ident):
         self.internalStoreId = ident
@@ -109,23 +369,144 @@ class Object():
     def getObjectId(self):
         return self.internalStoreId
 
+    def findAttribute(self, name):
+        '''
+        @return: The position of the attribute in the lists of names, types and values or None if it isn't set.
+        '''
+        index = self._index
+        if index is None:
+            index = getAttributeIndex(self._names)
+            setIndexSlot(self, index)
+        return index.get(name)
+
+    def hasAttribute(self, name):
+        try:
+            return self.findAttribute(name) is not None
+        except AttributeError:
+            # A subclass setting python attributes before calling Object.__init__.
+            return False
+
+    def popExtra(self, name):
+        '''
+        Removes the python attribute which an attribute of the same name is going to replace.
+        @return: Its value or None.
+        '''
+        if not self._extra:
+            return None
+        return self.__dict__.pop(name, None)
+
     def setType(self, name, hsn2type):
-        self.internalStoreType[name] = hsn2type
+        i = self.findAttribute(name)
+        if i is None:
+            self.addAttribute(hsn2type, name, self.popExtra(name))
+        else:
+            self.unshareAttributes(True)
+            self._types[i] = hsn2type
+
+    def setValue(self, name, value):
+        '''
+        Replaces the value of an attribute which is already set. The type is left unchanged.
+        '''
+        i = self.findAttribute(name)
+        if i is None:
+            raise AttributeError("Attribute '%s' is not set. Use one of the add methods." % name)
+        self.unshareAttributes(True)
+        self._values[i] = value
 
     def getTypeStore(self):
-        return self.internalStoreType
+        '''
+        @return: dict-like view mapping attribute names to their types. Changing it changes the object.
+        '''
+        return TypeStore(self)
+
+    def getAttributeType(self, name):
+        i = self.findAttribute(name)
+        if i is None:
+            raise KeyError(name)
+        return self._types[i]
+
+    def getAttributeNames(self):
+        return list(self._names)
+
+    def getValues(self):
+        '''
+        @return: dict mapping attribute names to their values. Changing it doesn't affect the object.
+        '''
+        return dict(zip(self._names, self._values))
+
+    def iterAttributes(self):
+        '''
+        @return: iterator over (name, type, value) tuples of all attributes.
+        '''
+        return iter(zip(self._names, self._types, self._values))
 
     def isSet(self, name):
-        if self.internalStoreType.get(name) is None:
-            return False
-        return True
+        i = self.findAttribute(name)
+        return i is not None and self._types[i] is not None
+
+    def bindReferences(self, dsAdapter, jobId):
+        '''
+        Binds all BYTES attributes of the object, so that they can fetch their contents.
+        @param dsAdapter: HSN2DataStoreAdapter from which the contents will be fetched.
+        @param jobId: The id of the job in which the contents were uploaded.
+        '''
+        for value in self._values:
+            if isinstance(value, Reference):
+                value.bind(dsAdapter, jobId)
+
+    def clone(self, ident=None):
+        '''
+        Creates an object with the same attributes, e.g. one of many similar child objects.
+        The attributes are shared with a template (created on first use) until the clone is modified.
+        As long as attributes are only added to the clone, fromObject reuses the encoded attributes of the template.
+        References are copied, so that clones don't change each other's references.
+        @param ident: The id of the clone.
+        @return: The new object.
+        '''
+        template = self._template
+        if template is None or not template.matches(self):
+            template = self._template = ObjectTemplate(self._names, self._types, self._values)
+        return template.clone(ident)
+
+    def unshareAttributes(self, changesTemplated=False):
+        '''
+        Gives a clone its own lists of attributes before it is modified.
+        @param changesTemplated: True if the modification can change attributes taken from the template
+                and not only add new ones. The object stops reusing the encoding of the template then.
+        '''
+        if type(self._names) is tuple:
+            self._names = list(self._names)
+            self._types = list(self._types)
+            self._values = list(self._values)
+        if changesTemplated:
+            self._template = None
 
     def addAttribute(self, hsn2type, name, value):
         '''
         Adding an attribute which is already set will replace the previous type/value.
         '''
-        setattr(self, name, value)
-        self.internalStoreType[name] = hsn2type
+        index = self._index
+        if index is not None:
+            i = index.get(name)
+        elif name in self._names:
+            # Objects being built don't need an index.
+            i = self._names.index(name)
+        else:
+            i = None
+        if i is not None:
+            self.unshareAttributes(True)
+            self._types[i] = hsn2type
+            self._values[i] = value
+        else:
+            if type(self._names) is tuple:
+                self.unshareAttributes()
+            if self._extra:
+                self.popExtra(name)
+            self._names.append(name)
+            self._types.append(hsn2type)
+            self._values.append(value)
+            if index is not None:
+                setIndexSlot(self, None)
 
     def addFlag(self, name):
         self.addAttribute("EMPTY", name, None)
@@ -169,8 +550,333 @@ class Object():
         self.addAttribute("OBJECT", name, long(value))
 
     def removeAttribute(self, name):
-        delattr(self, name)
-        del(self.internalStoreType[name])
+        i = self.findAttribute(name)
+        if i is None:
+            raise AttributeError(name)
+        self.unshareAttributes(True)
+        del self._names[i]
+        del self._types[i]
+        del self._values[i]
+        setIndexSlot(self, None)
+
+
+class ObjectTemplate(object):
+    '''
+    Frozen attributes of an object shared by its clones, with their encoding cached for fromObject.
+    '''
+    __slots__ = ('names', 'types', 'values', 'hasReferences', 'encoded', 'encodedPrefixes')
+
+    def __init__(self, names, hsn2types, values):
+        self.names = tuple(names)
+        self.types = tuple(hsn2types)
+        self.hasReferences = "BYTES" in self.types
+        if self.hasReferences:
+            values = [copyReference(value) for value in values]
+        self.values = tuple(values)
+        self.encoded = None
+        self.encodedPrefixes = dict()
+
+    def clone(self, ident=None):
+        values = self.values
+        if self.hasReferences:
+            values = tuple([copyReference(value) for value in values])
+        obj = newObject(ident, self.names, self.types, values)
+        setTemplateSlot(obj, self)
+        return obj
+
+    def referencesMatch(self, obj):
+        '''
+        @return: True if the references of the object still point where those of the template do.
+                 They are the only values which can be changed without the object noticing.
+        '''
+        for (value, tValue) in izip(obj._values, self.values):
+            if type(tValue) is Reference and value.getBoth() != tValue.getBoth():
+                return False
+        return True
+
+    def sharedCount(self, obj):
+        '''
+        @return: The number of leading attributes of the object which are still those of the template.
+        '''
+        if self.hasReferences and not self.referencesMatch(obj):
+            return 0
+        return len(self.names)
+
+    def matches(self, obj):
+        return len(obj._names) == len(self.names) and self.sharedCount(obj) == len(self.names)
+
+    def getEncodedPrefix(self, count):
+        '''
+        @return: The serialized ObjectData holding the first count attributes.
+        '''
+        if self.encoded is None:
+            self.encoded = list()
+            for attribute in izip(self.names, self.types, self.values):
+                pbObject = Object_pb2.ObjectData()
+                addPbAttributes(pbObject, (attribute,))
+                self.encoded.append(pbObject.SerializePartialToString())
+        data = self.encodedPrefixes.get(count)
+        if data is None:
+            data = self.encodedPrefixes[count] = ''.join(self.encoded[:count])
+        return data
+
+
+def copyReference(value):
+    if type(value) is Reference:
+        return Reference(value.key, value.store)
+    return value
+
+
+class LazyObject(Object):
+    '''
+    View of an object in the external format with the API of the internal one.
+    Attributes are decoded on first access. The object is converted to the internal
+    format as soon as it is modified, until then it is sent back to the object store unchanged.
+    '''
+    __slots__ = ('pbObject', 'pbAttrs', 'decoded')
+
+    def __init__(self, pbObject):
+        self.internalStoreId = pbObject.id
+        self._template = None
+        self._index = None
+        self._extra = False
+        self.pbObject = pbObject
+        self.pbAttrs = None
+        self.decoded = None
+
+    def __getattr__(self, name):
+        if name in lazySlots:
+            # Not set yet, e.g. by a subclass setting python attributes before calling LazyObject.__init__.
+            raise AttributeError(name)
+        if name.startswith('_') or self.pbObject is None:
+            return Object.__getattr__(self, name)
+        if self.decoded is not None and name in self.decoded:
+            return self.decoded[name]
+        attr = self.getPbAttrs().get(name)
+        if attr is None:
+            raise AttributeError(name)
+        value = toAttribute(attr)[1]
+        if self.decoded is None:
+            self.decoded = dict()
+        self.decoded[name] = value
+        return value
+
+    def getPbAttrs(self):
+        '''
+        @return: dict mapping attribute names to attributes in external format.
+        '''
+        if self.pbAttrs is None:
+            self.pbAttrs = dict((internName(attr.name), attr) for attr in self.pbObject.attrs)
+        return self.pbAttrs
+
+    def findAttribute(self, name):
+        if getattr(self, 'pbObject', None) is not None:
+            if name not in self.getPbAttrs():
+                return None
+            # Looking for the position of an attribute means it is going to be changed.
+            self.materialize()
+        return Object.findAttribute(self, name)
+
+    def getAttributeType(self, name):
+        if self.pbObject is None:
+            return Object.getAttributeType(self, name)
+        return typeDecoders[self.getPbAttrs()[name].type][0]
+
+    def getAttributeNames(self):
+        if self.pbObject is None:
+            return Object.getAttributeNames(self)
+        return [internName(attr.name) for attr in self.pbObject.attrs]
+
+    def getValues(self):
+        self.materialize()
+        return Object.getValues(self)
+
+    def iterAttributes(self):
+        self.materialize()
+        return Object.iterAttributes(self)
+
+    def isSet(self, name):
+        if self.pbObject is None:
+            return Object.isSet(self, name)
+        return name in self.getPbAttrs()
+
+    def bindReferences(self, dsAdapter, jobId):
+        if self.pbObject is None:
+            return Object.bindReferences(self, dsAdapter, jobId)
+        # Only the BYTES attributes are decoded.
+        for (name, attr) in self.getPbAttrs().iteritems():
+            if attr.type == bytesType:
+                getattr(self, name).bind(dsAdapter, jobId)
+
+    def materialize(self):
+        '''
+        Decodes all the remaining attributes and detaches the object from the external format.
+        '''
+        if self.pbObject is None:
+            return
+        decoded = self.decoded or dict()
+        (self._names, self._types, self._values, self._index) = ([], [], [], None)
+        for attr in self.pbObject.attrs:
+            (value_type, value) = toAttribute(attr)
+            name = internName(attr.name)
+            Object.addAttribute(self, value_type, name, decoded.get(name, value))
+        self.pbObject = None
+        self.pbAttrs = None
+        self.decoded = None
+
+    def __reduce__(self):
+        # An unmodified view travels as its serialized message.
+        if self.pbObject is None:
+            return Object.__reduce__(self)
+        args = (self.pbObject.SerializeToString(), type(self))
+        state = getExtraState(self, lazySlots)
+        if state is None:
+            return (restoreLazyObject, args)
+        return (restoreLazyObject, args, (None, state))
+
+    def setObjectId(self, ident):
+        self.materialize()
+        Object.setObjectId(self, ident)
+
+    def clone(self, ident=None):
+        self.materialize()
+        return Object.clone(self, ident)
+
+    def setType(self, name, hsn2type):
+        self.materialize()
+        Object.setType(self, name, hsn2type)
+
+    def setValue(self, name, value):
+        self.materialize()
+        Object.setValue(self, name, value)
+
+    def addAttribute(self, hsn2type, name, value):
+        self.materialize()
+        Object.addAttribute(self, hsn2type, name, value)
+
+    def removeAttribute(self, name):
+        self.materialize()
+        Object.removeAttribute(self, name)
+
+
+# Setters of the slots of Object. Object.__setattr__ is too slow for bulk loading.
+(setIdSlot, setNamesSlot, setTypesSlot, setValuesSlot, setTemplateSlot, setIndexSlot, setExtraSlot) = (
+    Object.internalStoreId.__set__, Object._names.__set__, Object._types.__set__, Object._values.__set__,
+    Object._template.__set__, Object._index.__set__, Object._extra.__set__)
+
+
+objectSlots = frozenset(Object.__slots__)
+lazySlots = frozenset(LazyObject.__slots__)
+
+
+def getExtraState(obj, skip=frozenset()):
+    '''
+    Collects the python attributes of an object which aren't HSN2 attributes: those in __dict__
+    and the slots added by subclasses.
+    @param skip: Names of slots which aren't collected.
+    @return: dict mapping the names to the values or None if there are none.
+    '''
+    cls = type(obj)
+    if cls is Object and not obj._extra:
+        return None
+    state = dict(obj.__dict__) if obj._extra else dict()
+    if cls is not Object:
+        for name in copy_reg._slotnames(cls):
+            if name in objectSlots or name in skip:
+                continue
+            try:
+                state[name] = object.__getattribute__(obj, name)
+            except AttributeError:
+                pass
+    return state or None
+
+
+def newObject(ident, names, hsn2types, values, cls=Object):
+    '''
+    Creates an object which takes ownership of the given lists of attribute names, types and values.
+    @param cls: Object or a subclass, whose __init__ isn't called.
+    '''
+    obj = cls.__new__(cls)
+    setIdSlot(obj, ident)
+    setNamesSlot(obj, names)
+    setTypesSlot(obj, hsn2types)
+    setValuesSlot(obj, values)
+    setTemplateSlot(obj, None)
+    setIndexSlot(obj, None)
+    setExtraSlot(obj, False)
+    return obj
+
+
+def restoreObject(ident, names, hsn2types, values, cls=Object):
+    '''
+    Recreates an object pickled by Object.__reduce__.
+    '''
+    obj = newObject(ident, map(internName, names), list(hsn2types), list(values), cls)
+    if issubclass(cls, LazyObject):
+        # A materialized view.
+        (obj.pbObject, obj.pbAttrs, obj.decoded) = (None, None, None)
+    return obj
+
+
+def restoreLazyObject(data, cls=LazyObject):
+    '''
+    Recreates a LazyObject pickled by LazyObject.__reduce__.
+    '''
+    obj = cls.__new__(cls)
+    LazyObject.__init__(obj, Object_pb2.ObjectData.FromString(data))
+    return obj
+
+
+def dumpsObjects(objects):
+    '''
+    Serializes objects for passing them to other processes, e.g. to a multiprocessing.Pool.
+    Objects with the same attribute names and types share a shape, which is stored once,
+    and the rest is encoded with marshal. Unmodified LazyObjects are stored as their serialized message.
+    Only the HSN2 attributes are kept: objects are loaded as Object (or LazyObject) whatever their class,
+    use pickle for subclasses with state of their own.
+    @param objects: Iterable of objects in internal format.
+    @return: str to be decoded with loadsObjects.
+    '''
+    shapeTable = dict()
+    rows = list()
+    for obj in objects:
+        if isinstance(obj, LazyObject) and obj.pbObject is not None:
+            rows.append(obj.pbObject.SerializeToString())
+            continue
+        shape = (tuple(obj._names), tuple(obj._types))
+        index = shapeTable.get(shape)
+        if index is None:
+            index = shapeTable[shape] = len(shapeTable)
+        # References are the only values which are tuples.
+        values = tuple([(value.key, value.store) if type(value) is Reference else value for value in obj._values])
+        rows.append((obj.internalStoreId, index, values))
+    return marshal.dumps((sorted(shapeTable, key=shapeTable.get), rows), 2)
+
+
+def loadsObjects(data):
+    '''
+    Decodes objects serialized by dumpsObjects. Like pickle it must only be used with trusted data.
+    @param data: str returned by dumpsObjects.
+    @return: list of objects in internal format.
+    '''
+    (shapeTable, rows) = marshal.loads(data)
+    shapes = list()
+    for (names, hsn2types) in shapeTable:
+        hasReferences = "BYTES" in hsn2types
+        shapes.append((map(internName, names), list(hsn2types), hasReferences))
+    objects = list()
+    for row in rows:
+        if type(row) is str:
+            objects.append(restoreLazyObject(row))
+            continue
+        (ident, index, values) = row
+        (names, hsn2types, hasReferences) = shapes[index]
+        if hasReferences:
+            values = [Reference(*value) if type(value) is tuple else value for value in values]
+        else:
+            values = list(values)
+        objects.append(newObject(ident, names[:], hsn2types[:], values))
+    return objects
 
 
 def toBoolValue(value):
@@ -199,21 +905,35 @@ def toObject(pbObject):
     @return: An object in internal format.
     '''
     intObject = Object(pbObject.id)
+    (names, hsn2types, values) = (intObject._names, intObject._types, intObject._values)
     for attr in pbObject.attrs:
-        value_type = enumwrap.getName(attr, "Type", attr.type)
-        value_name = types.get(value_type)
-        if value_name is not None:
-            value = getattr(attr, value_name)
-            if value_type == "BYTES":
-                intObject.addBytes(
-                    attr.name, attr.data_bytes.key, attr.data_bytes.store)
-                continue
+        try:
+            (value_type, decode) = typeDecoders[attr.type]
+        except KeyError:
+            raise BadValueException("Unknown attribute type: %s" % attr.type)
+        name = internName(attr.name)
+        if name in names:
+            intObject.addAttribute(value_type, name, decode(attr))
         else:
-            value = None
-        intObject.addAttribute(value_type, attr.name, value)
+            names.append(name)
+            hsn2types.append(value_type)
+            values.append(decode(attr))
     return intObject
 
 
+def toAttribute(attr):
+    '''
+    Process the external format of a single attribute to the internal one.
+    @param attr: An attribute in external format.
+    @return: A tuple containing the type name and the value in internal format.
+    '''
+    try:
+        (value_type, decode) = typeDecoders[attr.type]
+    except KeyError:
+        raise BadValueException("Unknown attribute type: %s" % attr.type)
+    return (value_type, decode(attr))
+
+
 def fromObject(intObject):
     '''
     Process the internal format of the object to the external one.
@@ -221,44 +941,279 @@ def fromObject(intObject):
     @param intObject: An object in internal format.
     @return: An object in external format.
     '''
+    if isinstance(intObject, LazyObject) and intObject.pbObject is not None:
+        return intObject.pbObject
     pbObject = Object_pb2.ObjectData()
+    template = intObject._template
+    if template is None:
+        addPbAttributes(pbObject, intObject.iterAttributes())
+    else:
+        shared = template.sharedCount(intObject)
+        if shared:
+            pbObject.MergeFromString(template.getEncodedPrefix(shared))
+        addPbAttributes(pbObject, izip(intObject._names[shared:], intObject._types[shared:],
+                                       intObject._values[shared:]))
     objId = intObject.getObjectId()
     if objId is not None:
         pbObject.id = objId
-    for attr_name, value_type in intObject.getTypeStore().iteritems():
-        attr = pbObject.attrs.add()
-        attr.name = attr_name
-        attr.type = enumwrap.getValue(attr, "Type", value_type)
-        value_name = types.get(value_type)
-        if value_name is not None:
-            if value_type == "BYTES":
-                ref = getattr(intObject, attr_name)
-                (refKey, refStore) = ref.getBoth()
-                attr.data_bytes.key = refKey
-                if refStore is not None:
-                    attr.data_bytes.store = refStore
-            else:
-                setattr(attr, value_name, getattr(intObject, attr_name))
     return pbObject
 
 
+def addPbAttributes(pbObject, attributes):
+    '''
+    Appends attributes in external format to an ObjectData.
+    @param pbObject: The ObjectData.
+    @param attributes: Iterable of (name, type, value) tuples.
+    '''
+    addAttr = pbObject.attrs.add
+    for (attr_name, value_type, value) in attributes:
+        try:
+            (number, value_name) = typeEncoders[value_type]
+        except KeyError:
+            raise BadValueException("Unknown attribute type: %s" % value_type)
+        attr = addAttr()
+        attr.name = attr_name
+        attr.type = number
+        if value_name is None:
+            continue
+        if number == bytesType:
+            (refKey, refStore) = value.getBoth()
+            attr.data_bytes.key = refKey
+            if refStore is not None:
+                attr.data_bytes.store = refStore
+        else:
+            setattr(attr, value_name, value)
+
+
 def toObjectsFromJSON(jsonDump, ignoreIds=False):
     '''
     Reads objects from a hsn2-unicorn dump file.
-    @param jsonDump: The unicorn dump from which objects will be loaded.
+    @param jsonDump: The unicorn dump from which objects will be loaded (path or file object, optionally gzipped).
     @param ignoreIds: If True object ids will be ignored.
     @return list of objects in internal format.
     '''
-    retObjs = list()
-    text = open(jsonDump, 'rb').readlines()
-    text = [x.strip() for x in text]
-    text = ''.join(text)
-    strings = ['{' + x + '}' for x in text.strip('{}').split('}{')]
-    for string in strings:
-        obj = toObjectFromJSON(string, ignoreIds)
+    return list(iterObjectsFromJSON(jsonDump, ignoreIds))
+
+
+def iterDumpChunks(jsonDump, chunkSize=65536):
+    '''
+    Reads a dump file in chunks. Gzipped dumps are recognized by their magic number and decompressed on the fly.
+    @param jsonDump: Path or file object of the dump. File objects are not closed.
+    @param chunkSize: How many bytes to read (and at most to decompress) at once.
+    @return generator yielding non-empty chunks of the (decompressed) dump.
+    '''
+    ownsFile = isinstance(jsonDump, basestring)
+    dumpFile = open(jsonDump, 'rb') if ownsFile else jsonDump
+    try:
+        data = dumpFile.read(max(chunkSize, 2))
+        if data[:2] != gzipMagic:
+            while data:
+                yield data
+                data = dumpFile.read(chunkSize)
+            return
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        while data:
+            out = inflater.decompress(data, chunkSize)
+            while out:
+                yield out
+                out = inflater.decompress(inflater.unconsumed_tail, chunkSize)
+            if inflater.unused_data:
+                # Next member of a concatenated gzip file.
+                data = inflater.unused_data
+                inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                data = dumpFile.read(chunkSize)
+        out = inflater.flush()
+        if out:
+            yield out
+    finally:
+        if ownsFile:
+            dumpFile.close()
+
+
+def iterObjectsFromJSON(jsonDump, ignoreIds=False, chunkSize=65536):
+    '''
+    Reads objects from a hsn2-unicorn dump file one at a time.
+    The file is read in chunks, so only the objects being decoded are held in memory.
+    @param jsonDump: The unicorn dump from which objects will be loaded (path or file object, optionally gzipped).
+    @param ignoreIds: If True object ids will be ignored.
+    @param chunkSize: How many bytes to read at once.
+    @return generator yielding objects in internal format.
+    '''
+    decoder = json.JSONDecoder()
+    chunks = iterDumpChunks(jsonDump, chunkSize)
+    try:
+        buf = ''
+        pos = 0
+        eof = False
+        while True:
+            pos = jsonWhitespace.match(buf, pos).end()
+            if pos == len(buf):
+                if eof:
+                    break
+                (buf, pos) = (next(chunks, ''), 0)
+                eof = not buf
+                continue
+            try:
+                (js, pos) = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # The object is cut by the end of the chunk. Read at least as much as is
+                # already buffered, so that a large object is not decoded over and over.
+                if eof:
+                    raise
+                more = [buf[pos:]]
+                size = 0
+                while size < max(chunkSize, len(buf) - pos):
+                    chunk = next(chunks, '')
+                    if not chunk:
+                        eof = True
+                        break
+                    more.append(chunk)
+                    size = size + len(chunk)
+                (buf, pos) = (''.join(more), 0)
+                continue
+            obj = toObjectFromJSONData(js, ignoreIds)
+            if obj is not None:
+                yield obj
+    finally:
+        chunks.close()
+
+
+def findDumpBoundaries(jsonDump, rangeSize):
+    '''
+    Splits an uncompressed dump file into byte ranges starting at object boundaries.
+    A boundary is a '}' followed by '{' and a key. Inside a JSON string the quote after '{'
+    would end the string and could not be followed by a word character, so a match is never
+    inside a string.
+    @param jsonDump: Path of the dump.
+    @param rangeSize: Approximate size of a range in bytes.
+    @return list of offsets at which the ranges start, the last one being the file size.
+    '''
+    size = os.path.getsize(jsonDump)
+    offsets = [0]
+    dumpFile = open(jsonDump, 'rb')
+    try:
+        nominal = rangeSize
+        while nominal < size:
+            dumpFile.seek(nominal)
+            start = nominal
+            buf = ''
+            match = None
+            while match is None:
+                more = dumpFile.read(65536)
+                if not more:
+                    break
+                buf = buf + more
+                match = dumpBoundary.search(buf)
+                # Keep only what a match can span.
+                if match is None and len(buf) > 4096:
+                    start = start + len(buf) - 4096
+                    buf = buf[-4096:]
+            if match is None:
+                break
+            offsets.append(start + match.start(1))
+            nominal = max(nominal + rangeSize, offsets[-1] + 1)
+    finally:
+        dumpFile.close()
+    offsets.append(size)
+    return offsets
+
+
+def loadDumpRange(args):
+    '''
+    Decodes the objects in one range of a dump file. Used by the worker processes of iterObjectsFromJSONParallel.
+    @param args: Tuple containing the path of the dump, the start and end offsets and ignoreIds.
+    @return list of the objects.
+    '''
+    (jsonDump, start, end, ignoreIds) = args
+    dumpFile = open(jsonDump, 'rb')
+    try:
+        dumpFile.seek(start)
+        buf = dumpFile.read(end - start)
+    finally:
+        dumpFile.close()
+    decoder = json.JSONDecoder()
+    objects = list()
+    pos = jsonWhitespace.match(buf).end()
+    while pos < len(buf):
+        (js, pos) = decoder.raw_decode(buf, pos)
+        obj = toObjectFromJSONData(js, ignoreIds)
         if obj is not None:
-            retObjs.append(obj)
-    return retObjs
+            objects.append(obj)
+        pos = jsonWhitespace.match(buf, pos).end()
+    return objects
+
+
+def iterObjectsFromJSONParallel(jsonDump, ignoreIds=False, processes=None, ordered=True, rangeSize=16777216,
+                                timeout=600):
+    '''
+    Reads objects from a hsn2-unicorn dump file, decoding ranges of the file in a pool of processes.
+    Gzipped dumps and file objects cannot be split and are read by iterObjectsFromJSON.
+    @param jsonDump: The unicorn dump from which objects will be loaded.
+    @param ignoreIds: If True object ids will be ignored.
+    @param processes: Number of worker processes (default is the number of CPUs).
+    @param ordered: If False the objects of each range are yielded as soon as the range is decoded.
+    @param rangeSize: Approximate number of bytes decoded by a worker at once.
+    @param timeout: How many seconds to wait for a range to be decoded before raising multiprocessing.TimeoutError.
+    @return generator yielding objects in internal format.
+    '''
+    if not isinstance(jsonDump, basestring):
+        return iterObjectsFromJSON(jsonDump, ignoreIds)
+    dumpFile = open(jsonDump, 'rb')
+    try:
+        compressed = dumpFile.read(2) == gzipMagic
+    finally:
+        dumpFile.close()
+    if compressed:
+        return iterObjectsFromJSON(jsonDump, ignoreIds)
+    return _iterObjectsFromRanges(jsonDump, ignoreIds, processes, ordered, rangeSize, timeout)
+
+
+def _iterObjectsFromRanges(jsonDump, ignoreIds, processes, ordered, rangeSize, timeout):
+    offsets = findDumpBoundaries(jsonDump, rangeSize)
+    tasks = iter([(jsonDump, offsets[i], offsets[i + 1], ignoreIds) for i in xrange(len(offsets) - 1)])
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    # At most window decoded ranges are in flight or waiting to be yielded.
+    window = 2 * processes
+    pool = multiprocessing.Pool(processes)
+    finished = False
+    try:
+        pending = deque(pool.apply_async(loadDumpRange, (task,)) for task in islice(tasks, window))
+        while pending:
+            if ordered:
+                result = pending.popleft()
+            else:
+                result = _popReadyResult(pending, timeout)
+            # Exceptions raised in the worker (or when passing its result) are raised here.
+            objects = result.get(timeout)
+            for task in islice(tasks, 1):
+                pending.append(pool.apply_async(loadDumpRange, (task,)))
+            for obj in objects:
+                yield obj
+        finished = True
+    finally:
+        if finished:
+            pool.close()
+        else:
+            # Failed or abandoned, the ranges still being decoded aren't needed.
+            pool.terminate()
+        pool.join()
+
+
+def _popReadyResult(pending, timeout):
+    '''
+    Waits for any of the results to be ready and removes it from the queue.
+    '''
+    deadline = time.time() + timeout if timeout is not None else None
+    while True:
+        for result in pending:
+            if result.ready():
+                pending.remove(result)
+                return result
+        if deadline is not None and time.time() > deadline:
+            raise multiprocessing.TimeoutError()
+        pending[0].wait(0.05)
 
 
 def toObjectFromJSON(jsonString, ignoreIds=False):
@@ -268,8 +1223,16 @@ def toObjectFromJSON(jsonString, ignoreIds=False):
     @param ignoreIds: If True the object id will be ignored.
     @return an object in internal format.
     '''
-    import json
-    js = json.loads(jsonString)
+    return toObjectFromJSONData(json.loads(jsonString), ignoreIds)
+
+
+def toObjectFromJSONData(js, ignoreIds=False):
+    '''
+    Converts a single decoded object from a unicorn dump file to internal format.
+    @param js: The dictionary decoded from the object's JSON.
+    @param ignoreIds: If True the object id will be ignored.
+    @return an object in internal format.
+    '''
     attrs = js.get('attrs')
     if ignoreIds:
         intObject = Object()
@@ -287,50 +1250,314 @@ def toObjectFromJSON(jsonString, ignoreIds=False):
             value = attr.get(value_name)
             if value_type == "BYTES":
                 intObject.addBytes2(
-                    attr.get('name'), value.get('key'), value.get('store'))
+                    internName(attr.get('name')), value.get('key'), value.get('store'))
                 continue
         else:
             value = None
-        intObject.addAttribute(value_type, attr.get('name'), value)
+        intObject.addAttribute(value_type, internName(attr.get('name')), value)
     return intObject
 
 
+def readVarint(buf, pos):
+    '''
+    @return: A tuple containing the value of the varint at pos and the position after it.
+    '''
+    result = 0
+    shift = 0
+    try:
+        while True:
+            byte = ord(buf[pos])
+            pos = pos + 1
+            result = result | ((byte & 0x7f) << shift)
+            if byte < 0x80:
+                return (result, pos)
+            shift = shift + 7
+    except IndexError:
+        raise BadValueException("Truncated message")
+
+
+def openPayload(source):
+    '''
+    Gives access to a serialized message without copying it when possible.
+    @param source: str, buffer, mmap or file object. The message is read from the current position of the file.
+                   Regular files are memory mapped, other file objects (e.g. StringIO, GzipFile or pipes) are read.
+    @return: A tuple containing the indexable payload, the position at which the message starts in it
+             and the mmap to close when done (or None).
+    '''
+    if not hasattr(source, "read"):
+        return (source, 0, None)
+    if isinstance(source, mmap.mmap):
+        # Parsed in place, it's the caller's to close.
+        return (source, source.tell(), None)
+    if isinstance(source, (file, io.FileIO, io.BufferedReader)):
+        try:
+            fileno = source.fileno()
+            fileStat = os.fstat(fileno)
+            start = source.tell()
+            if stat.S_ISREG(fileStat.st_mode) and start < fileStat.st_size:
+                mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+                # As if the message was read.
+                source.seek(0, os.SEEK_END)
+                return (mapped, start, mapped)
+        except (ValueError, EnvironmentError):
+            pass
+    return (source.read(), 0, None)
+
+
+def iterRepeatedField(source, messageClass, fieldName):
+    '''
+    Iterates over the entries of a repeated field of a serialized message without parsing the whole message.
+    Only the entry being yielded is copied out of the payload.
+    @param source: str, buffer, mmap or file object holding the serialized message.
+    @param messageClass: The protocol buffers class of the message.
+    @param fieldName: The name of the repeated field.
+    @return: generator yielding the entries (messages, unicode strings or byte strings).
+    '''
+    field = messageClass.DESCRIPTOR.fields_by_name[fieldName]
+    (buf, pos, mapped) = openPayload(source)
+    try:
+        if field.type == field.TYPE_MESSAGE:
+            entryClass = type(getattr(messageClass(), fieldName).add())
+            decode = entryClass.FromString
+        elif field.type == field.TYPE_STRING:
+            decode = lambda data: data.decode("utf-8")
+        elif field.type == field.TYPE_BYTES:
+            decode = str
+        else:
+            # Numbers may be packed, so let the library parse them.
+            for value in getattr(messageClass.FromString(buf[pos:]), fieldName):
+                yield value
+            return
+        end = len(buf)
+        while pos < end:
+            (tag, pos) = readVarint(buf, pos)
+            wireType = tag & 7
+            if wireType == 0:
+                pos = readVarint(buf, pos)[1]
+            elif wireType == 1:
+                pos = pos + 8
+            elif wireType == 2:
+                (length, pos) = readVarint(buf, pos)
+                if pos + length > end:
+                    raise BadValueException("Truncated message")
+                if tag >> 3 == field.number:
+                    yield decode(buf[pos:pos + length])
+                pos = pos + length
+            elif wireType == 5:
+                pos = pos + 4
+            else:
+                raise BadValueException("Unsupported wire type %d" % wireType)
+    finally:
+        if mapped is not None:
+            mapped.close()
+
+
+def toUnicode(value):
+    if type(value) is unicode:
+        return value
+    return unicode(value)
+
+
+def fieldCoercer(field):
+    '''
+    @return: Function converting a python value for the field, or None if the value can be set as is.
+    '''
+    if field.type == field.TYPE_STRING:
+        return toUnicode
+    elif field.type == field.TYPE_BOOL:
+        return toBoolValue
+    elif field.type in (field.TYPE_INT64, field.TYPE_UINT64, field.TYPE_SINT64, field.TYPE_FIXED64,
+                        field.TYPE_SFIXED64):
+        return long
+    elif field.type in (field.TYPE_INT32, field.TYPE_UINT32, field.TYPE_SINT32, field.TYPE_FIXED32,
+                        field.TYPE_SFIXED32, field.TYPE_ENUM):
+        return int
+    elif field.type in (field.TYPE_FLOAT, field.TYPE_DOUBLE):
+        return float
+    return None
+
+
+class ResourceConverter(object):
+    '''
+    Converts between python lists and a Resources message holding a repeated field.
+    Entries of scalar fields are plain values, entries of message fields are dictionaries keyed by field name.
+    For message fields the coercion of every entry field is looked up in the message descriptor once,
+    when the converter is created.
+    '''
+
+    def __init__(self, messageClass, listField=None, defaults=None, fields=None):
+        '''
+        @param messageClass: The protocol buffers class of the message.
+        @param listField: The name of the repeated field. Defaults to the only repeated field of the message.
+        @param defaults: dict of values used for entry fields which are missing or None.
+        @param fields: Names of the entry fields which are converted. Defaults to all fields of the entry message.
+        '''
+        if listField is None:
+            repeated = [f.name for f in messageClass.DESCRIPTOR.fields if f.label == f.LABEL_REPEATED]
+            if len(repeated) != 1:
+                raise BadValueException("%s needs the name of its list field." % messageClass.DESCRIPTOR.name)
+            listField = repeated[0]
+        self.messageClass = messageClass
+        self.listField = listField
+        self.defaults = defaults or dict()
+        field = messageClass.DESCRIPTOR.fields_by_name[listField]
+        if field.type == field.TYPE_MESSAGE:
+            entryFields = field.message_type.fields
+            if fields is not None:
+                entryFields = [field.message_type.fields_by_name[name] for name in fields]
+            self.encodeEntries = self.buildEncoder(field.message_type.name, entryFields)
+            self.decodeEntry = self.buildDecoder([f.name for f in entryFields])
+        else:
+            (self.encodeEntries, self.decodeEntry) = (None, None)
+
+    def buildEncoder(self, entryName, fields):
+        '''
+        @return: Function adding the dictionaries to the repeated container.
+        '''
+        specs = [(f.name, self.defaults.get(f.name), fieldCoercer(f), f.label == f.LABEL_REQUIRED) for f in fields]
+
+        def encodeEntries(container, entries):
+            add = container.add
+            for entry in entries:
+                item = add()
+                get = entry.get
+                for (name, default, coerce, required) in specs:
+                    value = get(name)
+                    if value is None:
+                        value = default
+                        if value is None:
+                            if required:
+                                raise BadValueException("%s entry has no value of required '%s'." % (entryName, name))
+                            continue
+                    if coerce is not None:
+                        value = coerce(value)
+                    setattr(item, name, value)
+        return encodeEntries
+
+    def buildDecoder(self, names):
+        '''
+        @return: Function converting an entry to a dictionary.
+        '''
+        names = tuple(names)
+
+        def decodeEntry(item):
+            entry = dict()
+            for name in names:
+                entry[name] = getattr(item, name)
+            return entry
+        return decodeEntry
+
+    def encode(self, entries):
+        '''
+        @param entries: Iterable of values or dictionaries.
+        @return: The protocol buffers message.
+        '''
+        message = self.messageClass()
+        container = getattr(message, self.listField)
+        if self.encodeEntries is None:
+            container.extend(entries)
+        else:
+            self.encodeEntries(container, entries)
+        return message
+
+    def iterDecode(self, source):
+        '''
+        @param source: str, buffer, mmap or file object holding the serialized message.
+        @return: generator yielding the entries.
+        '''
+        entries = iterRepeatedField(source, self.messageClass, self.listField)
+        if self.decodeEntry is None:
+            return entries
+        return imap(self.decodeEntry, entries)
+
+    def decode(self, source):
+        '''
+        Parses the whole message at once, which is faster than iterDecode but holds all of it in memory.
+        @param source: str, buffer, mmap or file object holding the serialized message.
+        @return: list of the entries.
+        '''
+        (buf, pos, mapped) = openPayload(source)
+        try:
+            message = self.messageClass.FromString(buf[pos:])
+        finally:
+            if mapped is not None:
+                mapped.close()
+        entries = getattr(message, self.listField)
+        if self.decodeEntry is None:
+            return list(entries)
+        return map(self.decodeEntry, entries)
+
+
+resourceConverters = dict()
+
+
+def registerResource(messageClass, listField=None, defaults=None, fields=None):
+    '''
+    Creates the converter of a Resources message. Registering a message again replaces its converter.
+    @return: The converter.
+    '''
+    converter = ResourceConverter(messageClass, listField, defaults, fields)
+    resourceConverters[messageClass.DESCRIPTOR.full_name] = converter
+    return converter
+
+
+def getResourceConverter(messageClass):
+    '''
+    @return: The converter of the message, created with the defaults if it wasn't registered.
+    '''
+    converter = resourceConverters.get(messageClass.DESCRIPTOR.full_name)
+    if converter is None:
+        converter = registerResource(messageClass)
+    return converter
+
+
+registerResource(Resources_pb2.IpAddresses)
+registerResource(Resources_pb2.DnsQueries)
+registerResource(Resources_pb2.ProtocolEntries)
+registerResource(Resources_pb2.BehaviorsList, defaults={"description_text": u""},
+                 fields=("description_text", "discovery_method"))
+registerResource(Resources_pb2.JSContextList, fields=("id", "source", "eval"))
+registerResource(Resources_pb2.YaraMatchesList, defaults={"rule": u""}, fields=("rule", "namespace"))
+
+
 def toIpAddressList(ipList):
-    iList = Resources_pb2.IpAddresses()
-    iList.ip.extend(ipList)
-    return iList
+    return getResourceConverter(Resources_pb2.IpAddresses).encode(ipList)
 
 
 def fromIpAddressList(fileP):
-    ipList = Resources_pb2.IpAddresses()
-    ipList.ParseFromString(fileP.read())
+    nList = getResourceConverter(Resources_pb2.IpAddresses).decode(fileP)
     fileP.close()
-    nList = []
-    for ip in ipList.ip:
-        nList.append(ip)
     return nList
 
 
+def iterIpAddressList(source):
+    '''
+    @param source: str, buffer, mmap or file object holding an IpAddresses message.
+    @return: generator yielding the addresses.
+    '''
+    return getResourceConverter(Resources_pb2.IpAddresses).iterDecode(source)
+
+
 def toDnsList(dnsList):
-    dList = Resources_pb2.DnsQueries()
-    dList.dns.extend(dnsList)
-    return dList
+    return getResourceConverter(Resources_pb2.DnsQueries).encode(dnsList)
 
 
 def fromDnsList(fileP):
-    dnsList = Resources_pb2.DnsQueries()
-    dnsList.ParseFromString(fileP.read())
+    nList = getResourceConverter(Resources_pb2.DnsQueries).decode(fileP)
     fileP.close()
-    nList = []
-    for dns in dnsList.dns:
-        nList.append(dns)
     return nList
 
 
+def iterDnsList(source):
+    '''
+    @param source: str, buffer, mmap or file object holding a DnsQueries message.
+    @return: generator yielding the queries.
+    '''
+    return getResourceConverter(Resources_pb2.DnsQueries).iterDecode(source)
+
+
 def toFilterList(filterList):
-    fList = Resources_pb2.ProtocolEntries()
-    fList.frame.extend(filterList)
-    return fList
+    return getResourceConverter(Resources_pb2.ProtocolEntries).encode(filterList)
 
 
 def toObjectDomainVerdicts(result):
@@ -365,14 +1592,7 @@ def toBehaviorList(normalList):
     @param normalList: The list that is to be converted.
     @return: The protocol buffers message.
     '''
-    bList = Resources_pb2.BehaviorsList()
-    for behavior in normalList:
-        beh = bList.behavior.add()
-        beh.description_text = unicode(behavior.get("description_text", ""))
-        val = behavior.get("discovery_method")
-        if val is not None:
-            beh.discovery_method = unicode(val)
-    return bList
+    return getResourceConverter(Resources_pb2.BehaviorsList).encode(normalList)
 
 
 def fromBehaviorList(fileP):
@@ -383,18 +1603,16 @@ def fromBehaviorList(fileP):
     @param fileP: An object containing the message. It needs to support the read method.
     @return: The list of dictionaries.
     '''
-    bList = Resources_pb2.BehaviorsList()
-    bList.ParseFromString(fileP.read())
-    nList = []
-    for beh in bList.behavior:
-        obj = {"description_text": beh.description_text}
-        try:
-            obj["discovery_method"] = getattr(beh, "discovery_method")
-        except:
-            pass
-        finally:
-            nList.append(obj)
-    return nList
+    return getResourceConverter(Resources_pb2.BehaviorsList).decode(fileP)
+
+
+def iterBehaviorList(source):
+    '''
+    Generator version of fromBehaviorList.
+    @param source: str, buffer, mmap or file object holding a BehaviorsList message.
+    @return: generator yielding the dictionaries.
+    '''
+    return getResourceConverter(Resources_pb2.BehaviorsList).iterDecode(source)
 
 
 def toJSContextList(normalList):
@@ -404,13 +1622,7 @@ def toJSContextList(normalList):
     @param normalList: The list that is to be converted.
     @return: The protocol buffers message.
     '''
-    cList = Resources_pb2.JSContextList()
-    for context in normalList:
-        cont = cList.contexts.add()
-        cont.id = int(context.get("id"))
-        cont.source = unicode(context.get("source"))
-        cont.eval = toBoolValue(context.get("eval"))
-    return cList
+    return getResourceConverter(Resources_pb2.JSContextList).encode(normalList)
 
 
 def fromJSContextList(fileP):
@@ -420,17 +1632,16 @@ def fromJSContextList(fileP):
     @param fileP: An object containing the message. It needs to support the read method.
     @return: The list of dictionaries.
     '''
-    cList = Resources_pb2.JSContextList()
-    cList.ParseFromString(fileP.read())
-    nList = []
-    for cont in cList.contexts:
-        obj = {
-            "id": cont.id,
-            "source": cont.source,
-            "eval": cont.eval
-        }
-        nList.append(obj)
-    return nList
+    return getResourceConverter(Resources_pb2.JSContextList).decode(fileP)
+
+
+def iterJSContextList(source):
+    '''
+    Generator version of fromJSContextList.
+    @param source: str, buffer, mmap or file object holding a JSContextList message.
+    @return: generator yielding the dictionaries.
+    '''
+    return getResourceConverter(Resources_pb2.JSContextList).iterDecode(source)
 
 
 def toYaraMatchesList(matches):
@@ -441,14 +1652,7 @@ def toYaraMatchesList(matches):
     @param matches: The list that is to be converted.
     @return: The protocol buffers message.
     '''
-    pbmatches = Resources_pb2.YaraMatchesList()
-    for match in matches:
-        newmatch = pbmatches.matches.add()
-        newmatch.rule = unicode(match.get("rule", ""))
-        namespace = match.get("namespace")
-        if namespace is not None:
-            newmatch.namespace = unicode(namespace)
-    return pbmatches
+    return getResourceConverter(Resources_pb2.YaraMatchesList).encode(matches)
 
 
 def fromYaraMatchesList(pbmatches):
@@ -459,24 +1663,22 @@ def fromYaraMatchesList(pbmatches):
     @param pbmatches: An object containing the message. It needs to support the read method.
     @return: The list of dictionaries.
     '''
-    matches = Resources_pb2.YaraMatchesList()
-    matches.ParseFromString(pbmatches.read())
-    ret = []
-    for match in matches.matches:
-        obj = {"rule": match.rule}
-        try:
-            obj["namespace"] = getattr(match, "namespace")
-        except:
-            pass
-        finally:
-            ret.append(obj)
-    return ret
+    return getResourceConverter(Resources_pb2.YaraMatchesList).decode(pbmatches)
+
+
+def iterYaraMatchesList(source):
+    '''
+    Generator version of fromYaraMatchesList.
+    @param source: str, buffer, mmap or file object holding a YaraMatchesList message.
+    @return: generator yielding the dictionaries.
+    '''
+    return getResourceConverter(Resources_pb2.YaraMatchesList).iterDecode(source)
 
 if __name__ == '__main__':
     obj = toObjectsFromJSON('/root/dump/1334690752502.json', True)
     print obj
     for ob in obj:
-        print ob.__dict__
+        print ob.getValues()
         if ob.isSet("content"):
-            print ob.content.__dict__
+            print ob.content.getBoth()
     print fromObjects(obj)
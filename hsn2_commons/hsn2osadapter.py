@@ -18,12 +18,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import time
 
 from hsn2_commons import hsn2enumwrapper as enumwrap
 from hsn2_commons import hsn2objectwrapper as ow
 from hsn2_commons.hsn2bus import BadMessageException
 from hsn2_commons.hsn2bus import BusTimeoutException
 from hsn2_commons.hsn2bus import ShutdownException
+from hsn2_commons.hsn2ostracer import countObjects
 from hsn2_commons.hsn2rmq import RabbitMqBus
 from hsn2_protobuf import ObjectStore_pb2
 
@@ -69,6 +71,122 @@ class QueryStructure():
         self.negate = negate
 
 
+class RetryPolicy(object):
+    '''
+    Defines how long to wait for object store replies and when to resend requests.
+    The n-th try waits timeout * backoff ** (n - 1) seconds, but no longer than maxTimeout.
+    If hedgeDelay is set, a duplicate of a read request is sent when no reply arrived
+    within hedgeDelay seconds of a try. The first reply to any of the copies is used
+    and the remaining ones are discarded by their correlation ids.
+    '''
+    # Requests which can be sent more than once without changing the outcome.
+    resendable = ("GET", "QUERY", "UPDATE")
+    hedgeable = ("GET", "QUERY")
+
+    def __init__(self, maxTries=3, timeout=10, backoff=3, maxTimeout=600, hedgeDelay=None, resendPut=False):
+        '''
+        @param maxTries: How many times a request is sent before giving up.
+        @param timeout: How long to wait for the reply to the first try (in seconds).
+        @param backoff: The factor by which the timeout grows with each try.
+        @param maxTimeout: The upper limit for the timeout of a single try.
+        @param hedgeDelay: After how many seconds a duplicate read request is sent. None disables hedging.
+        @param resendPut: Whether PUT requests may be resent. Resending can store the objects twice.
+        '''
+        self.maxTries = maxTries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.maxTimeout = maxTimeout
+        self.hedgeDelay = hedgeDelay
+        self.resendPut = resendPut
+
+    def getTimeout(self, tries):
+        '''
+        @param tries: Which try is being made, starting from 1.
+        @return: How long to wait for the reply to the given try.
+        '''
+        return min(self.timeout * self.backoff ** (tries - 1), self.maxTimeout)
+
+    def canResend(self, reqType):
+        return reqType in self.resendable or self.resendPut
+
+    def canHedge(self, reqType):
+        return self.hedgeDelay is not None and reqType in self.hedgeable
+
+
+class PendingRequest(object):
+    '''
+    State of a request awaiting a reply from the object store.
+    '''
+
+    def __init__(self, objReq):
+        self.objReq = objReq
+        self.reqType = enumwrap.getName(objReq, "RequestType", objReq.type)
+        # Serialized once, resends and hedged copies reuse it.
+        self.body = objReq.SerializeToString()
+        self.sentAt = None
+        self.tries = 0
+        self.corrIds = []
+        self.deadline = None
+        self.hedgeAt = None
+
+    def nextEvent(self):
+        '''
+        @return: The time at which the request has to be resent or hedged.
+        '''
+        if self.hedgeAt is not None:
+            return min(self.hedgeAt, self.deadline)
+        return self.deadline
+
+
+class CompiledQuery(object):
+    '''
+    A set of query structures converted to the protocol format once.
+    Can be passed to HSN2ObjectStoreAdapter.query in place of a list of query structures
+    and re-issued against any job without converting the attributes again.
+    '''
+
+    def __init__(self, queryStructs=list()):
+        '''
+        @param queryStructs: A list of queryStructures.
+        '''
+        self.template = ObjectStore_pb2.ObjectRequest()
+        self.template.type = enumwrap.getValue(self.template, "RequestType", "QUERY")
+        for qS in queryStructs:
+            self.addQueryStructure(qS)
+
+    def addQueryStructure(self, qS):
+        '''
+        Converts a single query structure and appends it to the compiled query.
+        @param qS: The queryStructure that is to be added.
+        '''
+        attributes = qS.getAttributes()
+        negate = qS.getNegate()
+        pbObj = ow.fromObject(attributes)
+        for attr in pbObj.attrs:
+            queryObj = self.template.query.add()
+            val = getattr(attributes, attr.name)
+            queryObj.attr_name = attr.name
+            queryObj.negate = negate
+            if val is None:
+                queryObj.type = enumwrap.getValue(
+                    queryObj, "QueryType", "BY_ATTR_NAME")
+            else:
+                queryObj.type = enumwrap.getValue(
+                    queryObj, "QueryType", "BY_ATTR_VALUE")
+                queryObj.attr_value.CopyFrom(attr)
+
+    def buildRequest(self, jobId):
+        '''
+        Prepares an ObjectRequest for the given job.
+        @param jobId: The id of the job to which the query is addressed
+        @return: ObjectRequest
+        '''
+        objReq = ObjectStore_pb2.ObjectRequest()
+        objReq.CopyFrom(self.template)
+        objReq.job = jobId
+        return objReq
+
+
 class HSN2ObjectStoreAdapter(object):
     '''
     Responsible for communicating with the HSN2 object store.
@@ -79,64 +197,190 @@ class HSN2ObjectStoreAdapter(object):
     maxTries = 1
     keepRunning = True
     timeout = 600
+    queryChunk = 1000
+    maxRequestObjects = 1000
+    maxRequestBytes = 8 * 1024 * 1024
+    requestWindow = 4
+    importWindow = 4
+    progressInterval = 10
+    missingTTL = 300
+    missingCache = None
+    missingSwept = 0
+    retryPolicy = None
+    tracer = None
+    # How requests are spread when the bus has several object store queues:
+    # "job" sends all requests of a job to one queue, "roundrobin" does so
+    # only for writes and spreads reads over all queues.
+    sharding = "job"
+    unorderedTypes = ("GET", "QUERY")
 
-    def __init__(self, bus=None):
+    def __init__(self, bus=None, retryPolicy=None, tracer=None):
         '''
         Requires a working RabbitMqBus.
         @param bus:
+        @param retryPolicy: RetryPolicy to use. Defaults to maxTries tries, each waiting timeout seconds.
+        @param tracer: ObjectStoreTracer recording the timings of requests. None disables tracing.
         '''
         if bus is None:
             raise NoBusException()
         self.bus = bus
+        self.retryPolicy = retryPolicy
+        self.tracer = tracer
+        self.missingCache = dict()
+
+    def getRetryPolicy(self):
+        '''
+        @return: The RetryPolicy used for requests. Unless one was set, it is built from maxTries and timeout.
+        '''
+        if self.retryPolicy is not None:
+            return self.retryPolicy
+        return RetryPolicy(maxTries=self.maxTries, timeout=self.timeout, backoff=1)
 
     def sendRequest(self, objReq):
         '''
         Sends a prepared ObjectRequest to the object store.
+        Resends it according to the retry policy when the reply doesn't arrive in time.
         @param objReq: A previously prepared ObjectRequest.
         @return: ObjectResponse
         '''
-        waiting = True
-        tries = 1
-        objResp = None
-        while waiting and self.keepRunning:
-            try:
-                (mtype, reponse) = self.bus.sendCommand(
-                    "os", "ObjectRequest", objReq, sync=1, timeout=self.timeout)
-                if mtype != "ObjectResponse":
-                    raise BadMessageException("ObjectResponse", mtype)
-                # TODO: should implement appropriate mechanisms for various
-                # responses.
-                objResp = ObjectStore_pb2.ObjectResponse()
-                objResp.ParseFromString(reponse)
-                if enumwrap.getValue(objResp, "ResponseType", objResp.type) == "FAILURE":
-                    logging.error("Failed ObjectRequest: " + str(objResp))
-                    break
-                # logging.debug(objResp)
-                waiting = False
-            except BusTimeoutException:
-                if tries >= self.maxTries:
+        return self.sendRequests([objReq])[0]
+
+    def sendRequests(self, objReqs, window=None):
+        '''
+        Sends several prepared ObjectRequests at once and waits for all the replies,
+        so the whole batch costs a single round trip.
+        Requests without a reply are resent according to the retry policy.
+        @param objReqs: A list of previously prepared ObjectRequests.
+        @param window: How many requests may await a reply at once. None means no limit.
+        @return: list of ObjectResponses in the order of the requests.
+        '''
+        replies = dict(self.iterReplies(objReqs, window))
+        return [replies[i] for i in range(len(replies))]
+
+    def iterReplies(self, objReqs, window=None):
+        '''
+        Sends ObjectRequests pipelined and yields the replies as they arrive.
+        Requests are taken from objReqs only when there is room in the window, so it can be a generator.
+        Requests without a reply are resent according to the retry policy.
+        @param objReqs: An iterable of previously prepared ObjectRequests.
+        @param window: How many requests may await a reply at once. None means no limit.
+        @return: generator yielding tuples (index of the request, ObjectResponse).
+        '''
+        policy = self.getRetryPolicy()
+        source = enumerate(objReqs)
+        exhausted = False
+        inFlight = dict()
+        owners = dict()
+        try:
+            while self.keepRunning:
+                while not exhausted and (window is None or len(inFlight) < window):
+                    try:
+                        (i, objReq) = next(source)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    start = time.time()
+                    inFlight[i] = PendingRequest(objReq)
+                    if self.tracer is not None:
+                        self.tracer.record(inFlight[i].reqType, "serialize", time.time() - start,
+                                           *countObjects(objReq))
+                    self._publishTry(i, inFlight[i], owners, time.time(), policy)
+                if not inFlight:
+                    return
+                target = min(pending.nextEvent() for pending in inFlight.itervalues())
+                try:
+                    (corrId, mtype, response) = self.bus.awaitResponse(
+                        "os", owners.keys(), max(target - time.time(), 0))
+                except BusTimeoutException:
+                    # The deadlines are checked against the wall clock, a timeout reported early only waits again.
+                    self._handleLate(inFlight, owners, time.time(), policy)
+                    continue
+                i = owners.pop(corrId)
+                pending = inFlight.pop(i)
+                stale = [c for c in pending.corrIds if c != corrId]
+                for c in stale:
+                    del owners[c]
+                if stale:
+                    self.bus.abandonResponses(stale)
+                receivedAt = time.time()
+                objResp = self._parseReply(mtype, response)
+                if self.tracer is not None:
+                    self.tracer.record(pending.reqType, "wire", receivedAt - pending.sentAt,
+                                       *countObjects(pending.objReq))
+                    self.tracer.record(pending.reqType, "parse", time.time() - receivedAt,
+                                       *countObjects(objResp))
+                yield (i, objResp)
+            raise ShutdownException("Termination of service while requesting objects.")
+        finally:
+            if owners:
+                self.bus.abandonResponses(owners.keys())
+
+    def _publishTry(self, i, pending, owners, now, policy):
+        pending.tries = pending.tries + 1
+        self._publishCopy(i, pending, owners)
+        timeout = policy.getTimeout(pending.tries)
+        pending.deadline = now + timeout
+        pending.hedgeAt = None
+        if policy.canHedge(pending.reqType) and policy.hedgeDelay < timeout:
+            pending.hedgeAt = now + policy.hedgeDelay
+
+    def _publishCopy(self, i, pending, owners):
+        shardKey = pending.objReq.job
+        if self.sharding == "roundrobin" and pending.reqType in self.unorderedTypes:
+            shardKey = None
+        corrId = self.bus.publishCommand("os", "ObjectRequest", pending.body, shardKey)
+        if pending.sentAt is None:
+            pending.sentAt = time.time()
+        pending.corrIds.append(corrId)
+        owners[corrId] = i
+
+    def _handleLate(self, inFlight, owners, now, policy):
+        '''
+        Resends requests past their deadline and sends hedged duplicates of requests past their hedge time.
+        '''
+        for (i, pending) in inFlight.iteritems():
+            if pending.deadline <= now:
+                if pending.tries >= policy.maxTries or not policy.canResend(pending.reqType):
                     raise ObjectStoreException(
-                        "Object store not responding. Tried %d times." % tries)
-                else:
-                    tries = tries + 1
+                        "Object store not responding. Tried %d times." % pending.tries)
                 logging.info(
                     "ObjectRequest reply not received yet. Resending request")
-                pass
-        if objResp is None:
-            raise ShutdownException("Termination of service while requesting objects.")
+                self._publishTry(i, pending, owners, now, policy)
+            elif pending.hedgeAt is not None and pending.hedgeAt <= now:
+                logging.info("ObjectRequest reply late. Sending hedged request")
+                pending.hedgeAt = None
+                self._publishCopy(i, pending, owners)
+
+    def _parseReply(self, mtype, response):
+        if mtype != "ObjectResponse":
+            raise BadMessageException("ObjectResponse", mtype)
+        # TODO: should implement appropriate mechanisms for various
+        # responses.
+        objResp = ObjectStore_pb2.ObjectResponse()
+        objResp.ParseFromString(response)
+        if enumwrap.getName(objResp, "ResponseType", objResp.type) == "FAILURE":
+            logging.error("Failed ObjectRequest: " + str(objResp))
         return objResp
 
-    def objectsGet(self, jobId, objects):
+    def objectsGet(self, jobId, objects, lazy=False):
         '''
         Retrieve the objects by their ids.
         @param jobId The id of the job to which the objects belong
         @param objects A list of objects Ids to fetch. List as in [].
+        @param lazy Whether to return LazyObject views decoding attributes on first access [default=False]
         @return: list of retrieved objects in the internal format.
         '''
         logging.debug("Performing ObjectRequest GET request")
         if len(objects) == 0:
             logging.debug("No objects passed to objectsGet")
             return None
+        knownMissing = self.getKnownMissing(jobId, objects)
+        if knownMissing:
+            logging.debug("Skipping objects known to be missing: " + str(knownMissing))
+            objects = [obj for obj in objects if obj not in knownMissing]
+            if len(objects) == 0:
+                self.missing = list(knownMissing)
+                return []
         objReq = ObjectStore_pb2.ObjectRequest()
         objReq.job = jobId
         objReq.type = enumwrap.getValue(objReq, "RequestType", "GET")
@@ -145,13 +389,126 @@ class HSN2ObjectStoreAdapter(object):
         logging.info(
             "requesting objects " + str(objects) + " from " + str(jobId))
         objResp = self.sendRequest(objReq)
-        self.missing = objResp.missing
-        currentObjects = ow.toObjects(objResp.data)
+        self.rememberMissing(jobId, objResp.missing)
+        self.missing = list(objResp.missing) + list(knownMissing)
+        start = time.time()
+        currentObjects = ow.toObjects(objResp.data, lazy)
+        if self.tracer is not None:
+            self.tracer.record("GET", "convert", time.time() - start, *countObjects(objResp))
         return currentObjects
 
+    def getKnownMissing(self, jobId, objects):
+        '''
+        Checks which of the objects were recently reported missing by the object store.
+        @param jobId The id of the job to which the objects belong
+        @param objects A list of objects Ids.
+        @return: set of the ids known to be missing.
+        '''
+        cached = self.missingCache.get(jobId)
+        if not cached:
+            return set()
+        now = time.time()
+        known = set()
+        for obj in objects:
+            expires = cached.get(obj)
+            if expires is None:
+                continue
+            if expires > now:
+                known.add(obj)
+            else:
+                del cached[obj]
+        return known
+
+    def rememberMissing(self, jobId, objects):
+        '''
+        Stores the ids reported missing by the object store for missingTTL seconds.
+        @param jobId The id of the job to which the objects belong
+        @param objects A list of missing objects Ids.
+        '''
+        if not self.missingTTL or len(objects) == 0:
+            return
+        now = time.time()
+        if now - self.missingSwept > self.missingTTL:
+            self.missingSwept = now
+            for (job, cached) in self.missingCache.items():
+                for (obj, expires) in cached.items():
+                    if expires <= now:
+                        del cached[obj]
+                if not cached:
+                    del self.missingCache[job]
+        expires = now + self.missingTTL
+        cached = self.missingCache.setdefault(jobId, dict())
+        for obj in objects:
+            cached[obj] = expires
+
+    def forgetMissing(self, jobId=None, objects=None):
+        '''
+        Removes ids from the cache of missing objects.
+        @param jobId The id of the job. None clears the cache for all jobs.
+        @param objects A list of objects Ids. None clears the whole job.
+        '''
+        if jobId is None:
+            self.missingCache.clear()
+        elif objects is None:
+            self.missingCache.pop(jobId, None)
+        else:
+            cached = self.missingCache.get(jobId)
+            if cached:
+                for obj in objects:
+                    cached.pop(obj, None)
+
+    def objectsGetGraph(self, jobId, rootIds, direction="up", depth=None, parentAttr="parent"):
+        '''
+        Retrieve objects together with their ancestors or descendants.
+        The graph is walked breadth-first with one round of requests per level:
+        a single GET for the ancestors, or pipelined QUERY requests followed by a single GET for the descendants.
+        @param jobId The id of the job to which the objects belong
+        @param rootIds A list of ids of the objects from which to start.
+        @param direction "up" to follow parent references, "down" to look for children.
+        @param depth How many levels to walk away from the root objects. None means no limit.
+        @param parentAttr The name of the attribute referencing the parent object.
+        @return: dict mapping object ids to the retrieved objects in the internal format.
+        '''
+        if direction not in ("up", "down"):
+            raise ValueError("Unknown direction: %s" % str(direction))
+        found = dict()
+        level = self.objectsGet(jobId, list(set(rootIds))) or []
+        walked = 0
+        while level:
+            for obj in level:
+                found[obj.getObjectId()] = obj
+            if depth is not None and walked >= depth:
+                break
+            walked = walked + 1
+            if direction == "up":
+                nextIds = set(getattr(obj, parentAttr) for obj in level if obj.isSet(parentAttr))
+            else:
+                nextIds = set(self._queryChildren(jobId, [obj.getObjectId() for obj in level], parentAttr))
+            nextIds.difference_update(found)
+            if not nextIds:
+                break
+            level = self.objectsGet(jobId, list(nextIds)) or []
+        return found
+
+    def _queryChildren(self, jobId, parentIds, parentAttr):
+        '''
+        Queries for the children of all the given objects, with up to requestWindow queries awaiting a reply at once.
+        @return: list of ids of the children.
+        '''
+        objReqs = []
+        for parentId in parentIds:
+            obj = ow.Object()
+            obj.addObject(parentAttr, parentId)
+            objReqs.append(CompiledQuery([QueryStructure(obj)]).buildRequest(jobId))
+        children = []
+        for objResp in self.sendRequests(objReqs, self.requestWindow):
+            children.extend(objResp.objects)
+        return children
+
     def objectsUpdate(self, jobId, objects, overwrite=False):
         '''
         Update objects in the object store.
+        Large updates are split into several requests, up to requestWindow of them awaiting a reply at once.
         @param jobId The id of the job to which the objects belong
         @param objects The list of objects (internal format) which were modified.
         @param overwrite Whether to overwrite previously set attributes [default=False]
@@ -159,21 +516,19 @@ class HSN2ObjectStoreAdapter(object):
         logging.debug("Performing ObjectRequest UPDATE request")
         if len(objects) == 0:
             return None
-        objReq = ObjectStore_pb2.ObjectRequest()
-        objReq.job = jobId
-        objReq.type = enumwrap.getValue(objReq, "RequestType", "UPDATE")
-        objReq.overwrite = overwrite
+        header = ObjectStore_pb2.ObjectRequest()
+        header.job = jobId
+        header.type = enumwrap.getValue(header, "RequestType", "UPDATE")
+        header.overwrite = overwrite
         logging.debug("Objects being updated:")
         logging.debug(objects)
-        for obj in ow.fromObjects(objects):
-            objData = objReq.data.add()
-            objData.CopyFrom(obj)
-        logging.debug(objReq)
-        self.sendRequest(objReq)
+        for _ in self.iterReplies(self.splitRequests(header, objects), self.requestWindow):
+            pass
 
     def objectsPut(self, jobId, taskId, objects, raw=False):
         '''
         Update objects in the object store.
+        Large puts are split into several requests, up to requestWindow of them awaiting a reply at once.
         @param jobId The id of the job to which the objects belong
         @param taskId The id of the task to which the objects belong
         @param objects The list of objects (internal format) which were added
@@ -183,51 +538,157 @@ class HSN2ObjectStoreAdapter(object):
         logging.debug("Performing ObjectRequest PUT request")
         if len(objects) == 0:
             return None
-        objReq = ObjectStore_pb2.ObjectRequest()
-        objReq.job = jobId
-        objReq.task_id = taskId
+        header = ObjectStore_pb2.ObjectRequest()
+        header.job = jobId
+        header.task_id = taskId
         if raw:
-            objReq.type = enumwrap.getValue(objReq, "RequestType", "PUT_RAW")
+            header.type = enumwrap.getValue(header, "RequestType", "PUT_RAW")
         else:
-            objReq.type = enumwrap.getValue(objReq, "RequestType", "PUT")
+            header.type = enumwrap.getValue(header, "RequestType", "PUT")
         logging.debug("Objects being added:")
         logging.debug(objects)
-        for obj in ow.fromObjects(objects):
-            objData = objReq.data.add()
-            objData.CopyFrom(obj)
-        logging.debug(objReq)
-        objResp = self.sendRequest(objReq)
-        return objResp.objects
+        received = dict()
+        for (i, objResp) in self.iterReplies(self.splitRequests(header, objects), self.requestWindow):
+            received[i] = objResp.objects
+        # The ids are returned in the same container type as for a single request.
+        merged = ObjectStore_pb2.ObjectResponse()
+        for i in range(len(received)):
+            merged.objects.extend(received.pop(i))
+        self.forgetMissing(jobId, merged.objects)
+        return merged.objects
+
+    def importObjects(self, jobId, taskId, objects, window=None, progress=None):
+        '''
+        Stores objects from an iterable, e.g. a dump being read, with PUT_RAW requests.
+        The objects are packed into requests as in objectsPut and up to window requests
+        are sent ahead of the replies, so the objects never have to be in memory all at once.
+        The import rate is logged every progressInterval seconds.
+        @param jobId The id of the job to which the objects belong
+        @param taskId The id of the task to which the objects belong
+        @param objects Iterable of objects in the internal format.
+        @param window How many requests may await a reply at once [default=self.importWindow]
+        @param progress Optional callable receiving the number of stored objects and objects per second.
+        @return: List of object ids in the order of the objects.
+        '''
+        if window is None:
+            window = self.importWindow
+        header = ObjectStore_pb2.ObjectRequest()
+        header.job = jobId
+        header.task_id = taskId
+        header.type = enumwrap.getValue(header, "RequestType", "PUT_RAW")
+        sizes = []
+
+        def requests():
+            for objReq in self.splitRequests(header, objects):
+                sizes.append(len(objReq.data))
+                yield objReq
+
+        ids = []
+        received = dict()
+        nextIndex = 0
+        stored = 0
+        start = lastReport = time.time()
+        for (i, objResp) in self.iterReplies(requests(), window):
+            received[i] = objResp.objects
+            stored = stored + sizes[i]
+            while nextIndex in received:
+                ids.extend(received.pop(nextIndex))
+                nextIndex = nextIndex + 1
+            now = time.time()
+            if now - lastReport >= self.progressInterval:
+                lastReport = now
+                self._reportImport(stored, now - start, progress)
+        self._reportImport(stored, time.time() - start, progress)
+        self.forgetMissing(jobId, ids)
+        return ids
+
+    def _reportImport(self, stored, elapsed, progress):
+        rate = stored / elapsed if elapsed > 0 else 0.0
+        logging.info("Imported %d objects, %.1f objects/s" % (stored, rate))
+        if progress is not None:
+            progress(stored, rate)
+
+    def importDump(self, jobId, taskId, jsonDump, ignoreIds=False, window=None, progress=None):
+        '''
+        Stores the objects from a hsn2-unicorn dump file, reading it as the import progresses.
+        @param jsonDump: The unicorn dump from which objects will be loaded.
+        @param ignoreIds: If True object ids will be ignored.
+        @return: List of object ids in the order of the objects in the dump.
+        '''
+        return self.importObjects(jobId, taskId, ow.iterObjectsFromJSON(jsonDump, ignoreIds), window, progress)
+
+    def splitRequests(self, header, objects):
+        '''
+        Packs objects into requests, starting a new one whenever it would exceed
+        maxRequestObjects objects or maxRequestBytes bytes of serialized object data.
+        A single object bigger than maxRequestBytes is sent in a request of its own.
+        @param header: ObjectRequest without data used as the template for each request.
+        @param objects: Iterable of objects in the internal format.
+        @return: generator yielding the ObjectRequests.
+        '''
+        objReq = None
+        size = 0
+        convertTime = 0
+        for obj in objects:
+            start = time.time()
+            pbObj = ow.fromObject(obj)
+            elapsed = time.time() - start
+            objSize = pbObj.ByteSize()
+            if objReq is not None and (len(objReq.data) >= self.maxRequestObjects or
+                                       size + objSize > self.maxRequestBytes):
+                self._traceConvert(objReq, convertTime)
+                logging.debug(objReq)
+                yield objReq
+                objReq = None
+                convertTime = 0
+            if objReq is None:
+                objReq = ObjectStore_pb2.ObjectRequest()
+                objReq.CopyFrom(header)
+                size = 0
+            objReq.data.add().CopyFrom(pbObj)
+            size = size + objSize
+            convertTime = convertTime + elapsed
+        if objReq is not None:
+            self._traceConvert(objReq, convertTime)
+            logging.debug(objReq)
+            yield objReq
+
+    def _traceConvert(self, objReq, seconds):
+        if self.tracer is not None:
+            self.tracer.record(enumwrap.getName(objReq, "RequestType", objReq.type), "convert", seconds,
+                               *countObjects(objReq))
 
     def query(self, jobId, queryStructs=list()):
         '''
         Query the object store for objects with the filters specified by attributes
         @param jobId: The id of the job to which the query is addressed
-        @param queryStructs: A list of queryStructures.
+        @param queryStructs: A list of queryStructures or a CompiledQuery.
         '''
-        objReq = ObjectStore_pb2.ObjectRequest()
-        objReq.job = jobId
-        objReq.type = enumwrap.getValue(objReq, "RequestType", "QUERY")
-
-        for qS in queryStructs:
-            attributes = qS.getAttributes()
-            negate = qS.getNegate()
-            pbObj = ow.fromObject(attributes)
-            for attr in pbObj.attrs:
-                queryObj = objReq.query.add()
-                val = getattr(attributes, attr.name)
-                queryObj.attr_name = attr.name
-                queryObj.negate = negate
-                if val is None:
-                    queryObj.type = enumwrap.getValue(
-                        queryObj, "QueryType", "BY_ATTR_NAME")
-                else:
-                    queryObj.type = enumwrap.getValue(
-                        queryObj, "QueryType", "BY_ATTR_VALUE")
-                    queryObj.attr_value.CopyFrom(attr)
-        objResp = self.sendRequest(objReq)
+        if not isinstance(queryStructs, CompiledQuery):
+            queryStructs = CompiledQuery(queryStructs)
+        objResp = self.sendRequest(queryStructs.buildRequest(jobId))
         return objResp.objects
 
+    def queryIter(self, jobId, queryStructs=list(), chunk=None, lazy=False):
+        '''
+        Query the object store and retrieve the matching objects in bounded chunks.
+        Only one chunk of decoded objects is held in memory at a time.
+        @param jobId: The id of the job to which the query is addressed
+        @param queryStructs: A list of queryStructures or a CompiledQuery.
+        @param chunk: Maximum number of objects fetched per GET request [default=self.queryChunk]
+        @param lazy: Whether to return LazyObject views decoding attributes on first access [default=False]
+        @return: generator yielding lists of objects in the internal format.
+        '''
+        if chunk is None:
+            chunk = self.queryChunk
+        if chunk < 1:
+            raise ValueError("Chunk size has to be positive, got %s" % chunk)
+        ids = self.query(jobId, queryStructs)
+        for start in xrange(0, len(ids), chunk):
+            objects = self.objectsGet(jobId, ids[start:start + chunk], lazy)
+            if objects:
+                yield objects
+
 if __name__ == '__main__':
     fwBus = RabbitMqBus(host="localhost",
                         port=5672,
@@ -253,5 +714,9 @@ if __name__ == '__main__':
     print osCon.query(165, [qS, qS2]), "containing flag Bad and have parent 1"
     qS2.setNegate(True)
     print osCon.query(165, [qS, qS2]), "containing flag Bad and don't have parent 1"
-    for obj in osCon.objectsGet(165, osCon.query(165, [qS2])):
-        print obj.__dict__
+    compiled = CompiledQuery([qS, qS2])
+    for jobId in [165, 166]:
+        print osCon.query(jobId, compiled), "job %d, same compiled query" % jobId
+    for chunk in osCon.queryIter(165, [qS2], chunk=10):
+        for obj in chunk:
+            print obj.getValues()
@@ -0,0 +1,175 @@
+# Copyright (c) NASK, NCSC
+#
+# This file is part of HoneySpider Network 2.1.
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Timing of object store requests, broken down by request type and processing stage.
+The stages recorded by HSN2ObjectStoreAdapter are:
+    serialize - converting the ObjectRequest to bytes
+    wire - from sending the request until the reply arrives (including resends)
+    parse - converting the reply to an ObjectResponse
+    convert - converting objects between the internal and the external format
+'''
+
+from bisect import bisect_left
+import json
+import time
+
+
+def countObjects(msg):
+    '''
+    Counts the objects and attributes carried by an ObjectRequest or ObjectResponse.
+    @param msg: The message to inspect.
+    @return: A tuple containing the number of objects (or ids, or query entries) and the number of attributes.
+    '''
+    objects = len(msg.data) + len(msg.objects) + len(getattr(msg, "query", ()))
+    attrs = 0
+    for obj in msg.data:
+        attrs = attrs + len(obj.attrs)
+    return (objects, attrs)
+
+
+class Histogram(object):
+    '''
+    Distribution of durations in fixed buckets.
+    '''
+    # Upper bounds of the buckets in seconds. The last bucket holds everything above.
+    bounds = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+              0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.objects = 0
+        self.attrs = 0
+        self.buckets = [0] * (len(self.bounds) + 1)
+
+    def add(self, seconds, objects=0, attrs=0):
+        self.count = self.count + 1
+        self.total = self.total + seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        self.objects = self.objects + objects
+        self.attrs = self.attrs + attrs
+        self.buckets[bisect_left(self.bounds, seconds)] += 1
+
+    def percentile(self, fraction):
+        '''
+        @param fraction: Which percentile to estimate, e.g. 0.99.
+        @return: Upper bound of the bucket holding the percentile (max for the last bucket).
+        '''
+        if self.count == 0:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for (i, inBucket) in enumerate(self.buckets):
+            seen = seen + inBucket
+            if seen >= rank and inBucket:
+                if i < len(self.bounds):
+                    return min(self.bounds[i], self.max)
+                return self.max
+        return self.max
+
+    def snapshot(self):
+        '''
+        @return: dict with the statistics of the histogram.
+        '''
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "objects": self.objects,
+            "attrs": self.attrs,
+            "buckets": zip(self.bounds + (None,), self.buckets),
+        }
+
+
+class ObjectStoreTracer(object):
+    '''
+    Collects timings of object store requests in histograms kept per request type and stage.
+    Each timing can also be appended to a trace file as a line of JSON.
+    '''
+
+    def __init__(self, traceFile=None):
+        '''
+        @param traceFile: Path or file object to which the timings are written. None disables the trace file.
+        '''
+        self.histograms = dict()
+        self.ownsTraceFile = isinstance(traceFile, basestring)
+        if self.ownsTraceFile:
+            traceFile = open(traceFile, "a")
+        self.traceFile = traceFile
+
+    def record(self, reqType, stage, seconds, objects=0, attrs=0):
+        '''
+        @param reqType: The name of the request type, e.g. GET.
+        @param stage: The name of the processing stage, e.g. wire.
+        @param seconds: How long the stage took.
+        @param objects: The number of objects (or ids) handled in the stage.
+        @param attrs: The number of attributes handled in the stage.
+        '''
+        histogram = self.histograms.get((reqType, stage))
+        if histogram is None:
+            histogram = self.histograms[(reqType, stage)] = Histogram()
+        histogram.add(seconds, objects, attrs)
+        if self.traceFile is not None:
+            self.traceFile.write(json.dumps({
+                "time": time.time(),
+                "type": reqType,
+                "stage": stage,
+                "seconds": seconds,
+                "objects": objects,
+                "attrs": attrs,
+            }) + "\n")
+
+    def snapshot(self):
+        '''
+        @return: dict mapping (request type, stage) tuples to histogram statistics.
+        '''
+        return dict((key, histogram.snapshot()) for (key, histogram) in self.histograms.iteritems())
+
+    def report(self):
+        '''
+        @return: A human readable table with the collected statistics.
+        '''
+        lines = ["%-8s %-10s %8s %10s %10s %10s %10s %10s %10s" %
+                 ("type", "stage", "count", "total[s]", "mean[ms]", "p50[ms]", "p99[ms]", "objects", "attrs")]
+        for (key, histogram) in sorted(self.histograms.iteritems()):
+            snap = histogram.snapshot()
+            lines.append("%-8s %-10s %8d %10.3f %10.3f %10.3f %10.3f %10d %10d" %
+                         (key[0], key[1], snap["count"], snap["total"], snap["mean"] * 1000,
+                          snap["p50"] * 1000, snap["p99"] * 1000, snap["objects"], snap["attrs"]))
+        return "\n".join(lines)
+
+    def reset(self):
+        self.histograms = dict()
+
+    def close(self):
+        if self.traceFile is not None:
+            if self.ownsTraceFile:
+                self.traceFile.close()
+            else:
+                self.traceFile.flush()
+            self.traceFile = None
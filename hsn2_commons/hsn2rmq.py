@@ -44,12 +44,16 @@ class RabbitMqBus(Bus):
     channelOs = None
     exchange = ''
     fw_queue = 'fw:l'
+    # A single queue name or a list of queues served by separate object store consumers.
     os_queue = 'os:l'
+    os_queue_index = 0
     resp_queue = None
     app_id = None
     corr_id = None
 
     queue_configurations = None
+    abandoned_corr_ids = None
+    max_abandoned = 10000
     _keep_running = None
 
     def __init__(self, host="127.0.0.1", port=5672, app_id=None):
@@ -60,6 +64,7 @@ class RabbitMqBus(Bus):
         '''
         self._keep_running = True
         self.queue_configurations = set()
+        self.abandoned_corr_ids = set()
         self.host = host
         self.port = 5672 if port is None else int(port)
         if app_id is None:
@@ -149,34 +154,16 @@ class RabbitMqBus(Bus):
         @return: A tuple containing the message type as a string and the message body in that order.
         '''
         self.corr_id = None
-        if dest == "fw":
-            routing_key = self.fw_queue
-            channel = self.channelFw
-        elif dest == "os":
-            routing_key = self.os_queue
-            channel = self.channelOs
-        else:
-            raise Exception("Unknown destination: %s" % str(dest))
+        routing_key, channel = self._route(dest)
 
         if sync is 1:
             resp_queue = self.resp_queue
             if self.corr_id is None:
-                self.corr_id = "%s-%s" % (mtype,
-                                          ''.join(sample(string.digits, 10)))
+                self.corr_id = self._new_corr_id(mtype)
         else:
             resp_queue = None
 
-        channel.basic_publish(
-            exchange=self.exchange,
-            routing_key=routing_key,
-            properties=pika.BasicProperties(
-                type=str(mtype),
-                content_type="application/hsn2+protobuf",
-                app_id=self.app_id,
-                reply_to=resp_queue,
-                correlation_id=self.corr_id),
-            body=None if command is "" else command.SerializeToString()
-        )
+        self._publish(channel, routing_key, mtype, command, resp_queue, self.corr_id)
 
         if sync is 1:
             properties = None
@@ -184,7 +171,10 @@ class RabbitMqBus(Bus):
             while True:
                 method, properties, body = channel.basic_get(queue=resp_queue)
                 if properties:
-                    break
+                    if properties.correlation_id not in self.abandoned_corr_ids:
+                        break
+                    self._drop_abandoned(channel, method, properties)
+                    continue
                 if time.time() - wait_start > timeout:
                     raise BusTimeoutException()
                 if not self.keep_running:
@@ -193,6 +183,105 @@ class RabbitMqBus(Bus):
 
             return self.on_response(channel, method, properties, body)
 
+    def publishCommand(self, dest, mtype, command, shardKey=None):
+        '''
+        Send a command which expects a reply without waiting for it.
+        The reply is to be collected with awaitResponse.
+        @param dest: The name of the destination. Only "fw" and "os" are supported.
+        @param mtype: The message type written as a string.
+        @param command: The message that is to be sent or its serialized form.
+        @param shardKey: Commands with equal keys go to the same queue if the destination has several.
+                         None means the queues are used in turn.
+        @return: The correlation id of the sent message.
+        '''
+        routing_key, channel = self._route(dest, shardKey)
+        corr_id = self._new_corr_id(mtype)
+        self._publish(channel, routing_key, mtype, command, self.resp_queue, corr_id)
+        return corr_id
+
+    def awaitResponse(self, dest, corrIds, timeout):
+        '''
+        Wait for a reply to one of the previously published commands.
+        Replies with other correlation ids are late replies to abandoned commands and are discarded.
+        @param dest: The name of the destination the commands were sent to.
+        @param corrIds: Correlation ids of the commands for which a reply is accepted.
+        @param timeout: How long to wait for a reply.
+        @return: A tuple containing the correlation id, the message type and the message body in that order.
+        '''
+        channel = self._route(dest)[1]
+        wait_start = time.time()
+        while True:
+            method, properties, body = channel.basic_get(queue=self.resp_queue)
+            if properties:
+                if properties.correlation_id in corrIds:
+                    channel.basic_ack(delivery_tag=method.delivery_tag)
+                    return properties.correlation_id, properties.type, self._convert_body(body)
+                self._drop_abandoned(channel, method, properties)
+                continue
+            if time.time() - wait_start > timeout:
+                raise BusTimeoutException()
+            if not self.keep_running:
+                raise ShutdownException("Shutdown while awaiting synchronous response")
+            time.sleep(0.05)
+
+    def abandonResponses(self, corrIds):
+        '''
+        Marks replies to the given commands as no longer awaited, so they are dropped when they arrive.
+        @param corrIds: Correlation ids of the abandoned commands.
+        '''
+        if len(self.abandoned_corr_ids) > self.max_abandoned:
+            # Replies which never arrived would otherwise be remembered forever.
+            self.abandoned_corr_ids.clear()
+        self.abandoned_corr_ids.update(corrIds)
+
+    def _drop_abandoned(self, channel, method, properties):
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        self.abandoned_corr_ids.discard(properties.correlation_id)
+        logging.debug("Discarding late reply %s (%s)" %
+                      (properties.correlation_id, properties.type))
+
+    def _route(self, dest, shard_key=None):
+        if dest == "fw":
+            return self.fw_queue, self.channelFw
+        elif dest == "os":
+            return self._select_queue(self.os_queue, shard_key), self.channelOs
+        else:
+            raise Exception("Unknown destination: %s" % str(dest))
+
+    def _select_queue(self, queues, shard_key):
+        if isinstance(queues, basestring):
+            return queues
+        if shard_key is not None:
+            return queues[hash(shard_key) % len(queues)]
+        self.os_queue_index = (self.os_queue_index + 1) % len(queues)
+        return queues[self.os_queue_index]
+
+    @staticmethod
+    def _new_corr_id(mtype):
+        return "%s-%s" % (mtype, ''.join(sample(string.digits, 10)))
+
+    def _publish(self, channel, routing_key, mtype, command, resp_queue, corr_id):
+        channel.basic_publish(
+            exchange=self.exchange,
+            routing_key=routing_key,
+            properties=pika.BasicProperties(
+                type=str(mtype),
+                content_type="application/hsn2+protobuf",
+                app_id=self.app_id,
+                reply_to=resp_queue,
+                correlation_id=corr_id),
+            body=self._serialize(command)
+        )
+
+    @staticmethod
+    def _serialize(command):
+        if command is "":
+            return None
+        if isinstance(command, str):
+            # Already serialized by the caller.
+            return command
+        return command.SerializeToString()
+
     def on_response(self, ch, method, properties, body):
         ch.basic_ack(delivery_tag=method.delivery_tag)
         if self.corr_id and self.corr_id != properties.correlation_id and self.app_id != "cli":
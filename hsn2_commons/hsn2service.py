@@ -77,7 +77,8 @@ class HSN2Service(object):
                             default=self.serviceName, dest='serviceName')
         parser.add_argument('--service-queue-dest', '-q', action='store', help='service queue name',
                             default="", dest='serviceQueue')
-        parser.add_argument('--object-store-queue-name', '-o', action='store', help='object store queue name',
+        parser.add_argument('--object-store-queue-name', '-o', action='store',
+                            help='object store queue name (comma separated names spread the load over several queues)',
                             default=self.objectStoreQueue, dest='objectStoreQueue')
         return parser
 
@@ -75,6 +75,7 @@ class HSN2TaskProcessor(Process):
     objects = None
     newObjects = None
     lastMsg = None
+    lazyObjects = False
 
     def __init__(self, connector, datastore, serviceName, serviceQueue, objectStoreQueue, **extra):
         '''
@@ -85,6 +86,7 @@ class HSN2TaskProcessor(Process):
         @param serviceName: The name of the running service.
         @param serviceQueue: The queue the service should connect to.
         @param objectStoreQueue: The queue used for sending objects to the object store.
+                A list or a comma separated string of queues spreads the load over several object store consumers.
         '''
         Process.__init__(self)
         self.serviceName = serviceName
@@ -92,6 +94,8 @@ class HSN2TaskProcessor(Process):
         connectorPort = extra.get('connectorPort', 5672)
         self.fwBus = Bus.initBus(
             host=connector, port=connectorPort, app_id=serviceName)
+        if isinstance(objectStoreQueue, basestring) and "," in objectStoreQueue:
+            objectStoreQueue = [queue.strip() for queue in objectStoreQueue.split(",")]
         self.fwBus.os_queue = objectStoreQueue
         self.osAdapter = HSN2ObjectStoreAdapter(bus=self.fwBus)
         self.dsAdapter = HSN2DataStoreAdapter(datastore)
@@ -173,7 +177,9 @@ class HSN2TaskProcessor(Process):
             self.newObjects = []
             self.taskAccept()
             self.objects = self.osAdapter.objectsGet(
-                self.currentTask.job, [self.currentTask.object])
+                self.currentTask.job, [self.currentTask.object], lazy=self.lazyObjects)
+            for obj in self.objects:
+                obj.bindReferences(self.dsAdapter, self.currentTask.job)
             warnings = self.taskProcess()
             if warnings is None:
                 warnings = list()
@@ -238,7 +244,7 @@ class HSN2TaskProcessor(Process):
         self.objects[0].removeAttribute("Pork")
         try:
             print '''Printing hosts file'''
-            print self.dsAdapter.getFile(self.currentTask.job, self.objects[0].hosts.key)
+            print self.objects[0].hosts.read()
         except Exception:
             print '''No hosts file attached to object'''
         obj = ow.Object()
@@ -293,6 +299,9 @@ class HSN2TaskProcessor(Process):
         self.currentTask = None
         self.newObjects = None
         self.objects = None
+        if self.dsAdapter is not None:
+            ow.unbindReferences(self.dsAdapter)
+            self.dsAdapter.clearCache()
 
     def cleanup(self):
         '''
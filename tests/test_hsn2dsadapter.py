@@ -15,10 +15,84 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from StringIO import StringIO
+from SocketServer import ThreadingMixIn
 import os
+import re
+import tempfile
+import threading
 import unittest
 
-from hsn2_commons.hsn2dsadapter import HSN2DataStoreAdapter, DataStoreException
+from hsn2_commons import hsn2dsadapter
+from hsn2_commons.hsn2dsadapter import ConnectionPool, HSN2DataStoreAdapter, DataStoreException
+
+
+class FakeDataStoreHandler(BaseHTTPRequestHandler):
+    '''
+    Keeps uploaded files in memory. Connections are kept alive unless the server's dropAfterReply is set,
+    in which case the connection is closed without telling the client.
+    '''
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections = self.server.connections + 1
+
+    def reply(self, code, body):
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.server.dropAfterReply:
+            self.close_connection = 1
+
+    def do_POST(self):
+        encoding = self.headers.get("Transfer-Encoding")
+        self.server.encodings.append(encoding)
+        if encoding == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline(), 16)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+                if size == 0:
+                    break
+            data = "".join(chunks)
+        else:
+            data = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.files.append(data)
+        self.reply(201, "/data/%s/%d" % (self.path.split("/")[2], len(self.server.files)))
+
+    def do_GET(self):
+        m = re.match(r"/data/\d+/(\d+)$", self.path)
+        if m is None or not 0 < int(m.group(1)) <= len(self.server.files):
+            self.reply(404, "Not found")
+        else:
+            self.reply(200, self.server.files[int(m.group(1)) - 1])
+
+    def log_message(self, *args):
+        pass
+
+
+class Unseekable(object):
+    '''
+    File object which can only be read, like a socket.
+    '''
+
+    def __init__(self, data):
+        self.read = StringIO(data).read
+
+
+class FakeDataStore(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), FakeDataStoreHandler)
+        self.files = []
+        self.encodings = []
+        self.connections = 0
+        self.dropAfterReply = False
 
 
 class testHSN2DataStoreAdapter(unittest.TestCase):
@@ -67,3 +141,95 @@ class testHSN2DataStoreAdapter(unittest.TestCase):
         self.assertTrue(os.path.isfile(fpath))
         self.ds.removeTmp(fpath)
         self.assertFalse(os.path.isfile(fpath))
+
+
+class testConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeDataStore()
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.ds = HSN2DataStoreAdapter("http://127.0.0.1:%d" % self.server.server_address[1])
+
+    def tearDown(self):
+        self.ds.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testConnectionReused(self):
+        # The job id differs from the key, so only the last segment of "/data/7/1" is the key.
+        ident = self.ds.putBytes("content", 7)
+        self.assertEqual(ident, "1")
+        self.assertEqual(self.ds.getFile(7, ident), "content")
+        self.assertRaises(DataStoreException, self.ds.getFile, 7, 100)
+        stats = self.ds.getPoolStats()
+        self.assertEqual((stats["created"], stats["reused"], stats["requests"]), (1, 2, 3))
+        self.assertEqual(self.server.connections, 1)
+
+    def testUploadedKey(self):
+        for (reply, key) in [("/data/7/12", "12"), ("12\n", "12"), ("/data/7/12/", "12"),
+                             ("/data/7/12?version=3", "12"), ("Stored as 12, job 7.", "12")]:
+            self.assertEqual(hsn2dsadapter.getUploadedKey(reply), key)
+        self.assertEqual(hsn2dsadapter.getUploadedKey("created"), None)
+
+    def testAdaptersShareThePool(self):
+        other = HSN2DataStoreAdapter(self.ds.address)
+        self.assertTrue(other.pool is self.ds.pool)
+
+    def testReconnectWhenClosedByServer(self):
+        self.server.dropAfterReply = True
+        ident = self.ds.putBytes("content", 1)
+        self.assertEqual(self.ds.getFile(1, ident), "content")
+        stats = self.ds.getPoolStats()
+        self.assertEqual((stats["created"], stats["reconnects"]), (2, 1))
+        self.assertEqual(self.server.connections, 2)
+
+    def testNewConnectionsAfterFork(self):
+        pool = ConnectionPool(self.ds.address)
+        pool.request("GET", "/data/1/1")
+        self.assertEqual(pool.getStats()["idle"], 1)
+        pool.pid = -1
+        pool.request("GET", "/data/1/1")
+        self.assertEqual(pool.getStats()["created"], 2)
+        pool.clear()
+
+    def testPutFileInChunks(self):
+        data = os.urandom(hsn2dsadapter.uploadChunkSize * 3 + 100)
+        (fhandle, path) = tempfile.mkstemp()
+        try:
+            os.write(fhandle, data)
+            os.close(fhandle)
+            ident = self.ds.putFile(path, 2)
+        finally:
+            os.remove(path)
+        self.assertEqual(self.ds.getFile(2, ident), data)
+        self.assertEqual(self.server.encodings, [None])
+
+    def testPutStreamChunkedEncoding(self):
+        (readEnd, writeEnd) = os.pipe()
+        os.write(writeEnd, "x" * 1000)
+        os.close(writeEnd)
+        with os.fdopen(readEnd, "rb") as pipe:
+            ident = self.ds.putStream(pipe, 2)
+        self.assertEqual(self.ds.getFile(2, ident), "x" * 1000)
+        self.assertEqual(self.server.encodings, ["chunked"])
+
+    def testPutStreamShorterThanLength(self):
+        self.assertRaises(DataStoreException, self.ds.putStream, StringIO("abc"), 2, 10)
+
+    def testPutStreamResentAfterReconnect(self):
+        self.server.dropAfterReply = True
+        self.ds.putBytes("first", 2)
+        ident = self.ds.putStream(StringIO("second"), 2, 6)
+        self.assertEqual(self.ds.getFile(2, ident), "second")
+        self.assertEqual(self.ds.getPoolStats()["reconnects"], 2)
+
+    def testUnseekableStreamNotResent(self):
+        self.server.dropAfterReply = True
+        self.ds.putBytes("first", 2)
+        self.assertRaisesRegexp(DataStoreException, "can't be rewound", self.ds.putStream, Unseekable("second"), 2)
+        self.assertEqual(self.server.files, ["first"])
+        # On a new connection it is sent as usual.
+        self.ds.pool.clear()
+        self.assertEqual(self.ds.putStream(Unseekable("third"), 2), "2")
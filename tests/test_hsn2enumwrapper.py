@@ -0,0 +1,85 @@
+# Copyright (c) NASK, NCSC
+#
+# This file is part of HoneySpider Network 2.1.
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import subprocess
+import sys
+import unittest
+
+from google.protobuf import descriptor_pb2
+
+from hsn2_commons import hsn2enumwrapper as enumwrap
+import hsn2_protobuf
+from hsn2_protobuf import Object_pb2
+from hsn2_protobuf import ObjectStore_pb2
+from hsn2_protobuf import Process_pb2
+
+
+class testHSN2EnumWrapper(unittest.TestCase):
+
+    def setUp(self):
+        self.registered = enumwrap.registry.copy()
+        enumwrap.registry.clear()
+
+    def tearDown(self):
+        enumwrap.registry.clear()
+        enumwrap.registry.update(self.registered)
+
+    def testRegisteredOnFirstUse(self):
+        self.assertEqual(len(enumwrap.registry), 0)
+        enumwrap.getValue(Process_pb2.TaskError, "ReasonType", "DEFUNCT")
+        self.assertTrue(("hsn2.TaskError", "ReasonType") in enumwrap.registry)
+        self.assertFalse(("hsn2.ObjectRequest", "RequestType") in enumwrap.registry)
+        enumwrap.registerPackage(hsn2_protobuf)
+        self.assertTrue(("hsn2.ObjectRequest", "RequestType") in enumwrap.registry)
+        self.assertTrue(("hsn2.Attribute", "Type") in enumwrap.registry)
+
+    def testNoModulesImported(self):
+        code = "import sys; from hsn2_commons import hsn2enumwrapper; print sorted(sys.modules)"
+        modules = subprocess.check_output([sys.executable, "-c", code])
+        self.assertFalse("_pb2" in modules)
+
+    def testCompatibilityViews(self):
+        self.assertFalse("RequestType" in enumwrap.NameToNumber)
+        self.assertEqual(enumwrap.NameToNumber.get("RequestType"), None)
+        enumwrap.loadList(ObjectStore_pb2.ObjectRequest(), "RequestType")
+        self.assertEqual(enumwrap.NameToNumber["RequestType"]["GET"], ObjectStore_pb2.ObjectRequest.GET)
+        self.assertEqual(enumwrap.NumberToName["RequestType"][ObjectStore_pb2.ObjectRequest.GET], "GET")
+        self.assertEqual(list(enumwrap.NameToNumber), ["RequestType"])
+        self.assertEqual(len(enumwrap.NumberToName), 1)
+        self.assertRaises(KeyError, enumwrap.NameToNumber.__getitem__, "ReasonType")
+
+    def testNameAndValue(self):
+        objReq = ObjectStore_pb2.ObjectRequest()
+        value = enumwrap.getValue(objReq, "RequestType", "QUERY")
+        self.assertEqual(value, ObjectStore_pb2.ObjectRequest.QUERY)
+        self.assertEqual(enumwrap.getName(objReq, "RequestType", value), "QUERY")
+        self.assertEqual(enumwrap.getValue(Process_pb2.TaskError, "ReasonType", "DEFUNCT"),
+                         Process_pb2.TaskError.DEFUNCT)
+        self.assertEqual(enumwrap.getName(objReq, "RequestType", 12345), None)
+        self.assertEqual(enumwrap.getValue(objReq, "RequestType", "NO_SUCH_TYPE"), None)
+
+    def testSameNameInDifferentMessages(self):
+        # FieldDescriptorProto has its own Type enum, registered on first use.
+        types = enumwrap.getEnum(descriptor_pb2.FieldDescriptorProto(), "Type")
+        self.assertEqual(types.numbers["TYPE_STRING"], descriptor_pb2.FieldDescriptorProto.TYPE_STRING)
+        attrTypes = enumwrap.getEnum(Object_pb2.Attribute, "Type")
+        self.assertEqual(attrTypes.numbers["BYTES"], Object_pb2.Attribute.BYTES)
+        self.assertFalse("TYPE_STRING" in attrTypes.numbers)
+        self.assertEqual(enumwrap.getName(Object_pb2.Attribute(), "Type", Object_pb2.Attribute.BYTES), "BYTES")
+
+    def testUnknownEnum(self):
+        self.assertRaises(KeyError, enumwrap.getEnum, Object_pb2.Attribute, "NoSuchEnum")
@@ -0,0 +1,117 @@
+# Copyright (c) NASK, NCSC
+#
+# This file is part of HoneySpider Network 2.1.
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from hsn2_commons import hsn2objectwrapper as ow
+from hsn2_commons.hsn2objectbatch import ObjectBatch, iterRows
+from hsn2_commons.hsn2objectwrapper import BadValueException
+from hsn2_protobuf import ObjectStore_pb2
+
+
+def sampleObjects():
+    objects = list()
+    for i in range(10):
+        obj = ow.Object(i + 1)
+        obj.addInt("depth", i)
+        obj.addString("type", "url" if i % 2 else "file")
+        if i % 3 == 0:
+            obj.addFlag("malicious")
+        if i == 4:
+            obj.addFloat("score", 0.5)
+            obj.addBytes("content", 12, 1)
+            obj.addBool("active", True)
+        objects.append(obj)
+    return objects
+
+
+def attributeSet(obj):
+    return set((name, hsn2type, str(value)) for (name, hsn2type, value) in obj.iterAttributes())
+
+
+class testObjectBatch(unittest.TestCase):
+
+    def testFilters(self):
+        batch = ObjectBatch.fromObjects(sampleObjects())
+        self.assertEqual(len(batch), 10)
+        self.assertEqual(batch.getIds(batch.has("malicious")), [1, 4, 7, 10])
+        self.assertEqual(batch.getIds(batch.has("malicious") & batch.where("depth", ">", 4)), [7, 10])
+        self.assertEqual(batch.getIds(batch.where("type", "==", "url") & ~batch.has("malicious")), [2, 6, 8])
+        self.assertEqual(batch.count(batch.all() & ~batch.where("type", "<", "url")), 5)
+        self.assertEqual(batch.where("score", ">=", 0.5), 1 << 4)
+        self.assertEqual(batch.has("missing"), 0)
+        self.assertRaises(BadValueException, batch.where, "content", "==", 12)
+
+    def testFromResponse(self):
+        objects = sampleObjects()
+        objResp = ObjectStore_pb2.ObjectResponse()
+        objResp.data.extend(ow.fromObjects(objects))
+        batch = ObjectBatch.fromResponse(objResp)
+        self.assertEqual(batch.getValues("depth", batch.has("malicious")), [0, 3, 6, 9])
+        self.assertEqual(sorted(batch.strings), ["file", "url"])
+        for (expected, obj) in zip(objects, batch.iterObjects()):
+            self.assertEqual(attributeSet(obj), attributeSet(expected))
+        self.assertEqual(batch.getValue(4, "content").getBoth(), (12, 1))
+        self.assertEqual(batch.getValue(3, "content"), None)
+
+    def testTypeConflict(self):
+        batch = ObjectBatch()
+        batch.addAttributes(1, [("depth", "INT", 1)])
+        self.assertRaises(BadValueException, batch.addAttributes, 2, [("depth", "STRING", "1")])
+
+    def testNegativeSelections(self):
+        batch = ObjectBatch.fromObjects(sampleObjects())
+        self.assertEqual(batch.getIds(~batch.has("malicious")), [2, 3, 5, 6, 8, 9])
+        self.assertEqual(batch.getRows(~0b10), [0] + range(2, 10))
+        self.assertEqual(batch.count(~batch.has("malicious")), 6)
+        self.assertEqual(batch.getValues("depth", ~batch.where("depth", ">", 1)), [0, 1])
+        self.assertEqual(len(list(batch.iterObjects(~0))), 10)
+        self.assertRaises(BadValueException, iterRows, ~0b10)
+
+    def testValueRanges(self):
+        batch = ObjectBatch()
+        obj = ow.Object(1)
+        obj.addTime("created", -3600)
+        obj.addObject("parent", 2 ** 63 + 1)
+        obj.addBytes2("content", "feeder-key", "1")
+        obj.addBytes2("numeric", "12")
+        obj.addBytes("big", 2 ** 63 + 1, 2)
+        batch.addAttributes(obj.getObjectId(), obj.iterAttributes())
+        self.assertEqual(batch.getValue(0, "created"), -3600)
+        self.assertEqual(batch.getIds(batch.where("created", "<", 0)), [1])
+        self.assertEqual(batch.getValue(0, "parent"), 2 ** 63 + 1)
+        self.assertEqual(batch.getValue(0, "content").getBoth(), ("feeder-key", 1))
+        self.assertEqual(batch.getValue(0, "numeric").getBoth(), ("12", None))
+        self.assertEqual(batch.getValue(0, "big").getBoth(), (2 ** 63 + 1, 2))
+        self.assertEqual(attributeSet(batch.getObject(0)), attributeSet(obj))
+
+    def testRepeatedAttribute(self):
+        objects = ow.fromObjects(sampleObjects())
+        depth = [attr for attr in objects[0].attrs if attr.name == "depth"][0]
+        repeated = objects[0].attrs.add()
+        repeated.CopyFrom(depth)
+        repeated.data_int = 9
+        content = objects[4].attrs.add()
+        content.CopyFrom([attr for attr in objects[4].attrs if attr.name == "content"][0])
+        content.data_bytes.key = 13
+        batch = ObjectBatch.fromResponse(objects)
+        self.assertEqual(batch.getValue(0, "depth"), 9)
+        self.assertEqual(batch.getValue(1, "depth"), 1)
+        self.assertEqual(batch.getIds(batch.where("depth", "==", 9)), [1, 10])
+        self.assertEqual(batch.getIds(batch.has("content")), [5])
+        self.assertEqual(batch.getValue(4, "content").getBoth(), (13, 1))
+        self.assertEqual(len(batch.getColumn("depth").values), 10)
@@ -0,0 +1,104 @@
+# Copyright (c) NASK, NCSC
+#
+# This file is part of HoneySpider Network 2.1.
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import os
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from hsn2_commons import hsn2objectdump as od
+from hsn2_commons import hsn2objectwrapper as ow
+
+
+def sampleObjects():
+    objects = list()
+    for i in (5, 3, 9, 1):
+        obj = ow.Object(i)
+        obj.addString("url_original", "http://example.com/%d" % i)
+        obj.addInt("depth", i)
+        obj.addBytes("content", 100 + i, 1)
+        objects.append(obj)
+    return objects
+
+
+class testObjectDump(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(".hsn2")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def testRoundTrip(self):
+        self.assertEqual(od.writeObjects(self.path, sampleObjects()), 4)
+        objects = list(od.iterObjects(self.path))
+        self.assertEqual([obj.getObjectId() for obj in objects], [5, 3, 9, 1])
+        self.assertEqual(objects[1].url_original, "http://example.com/3")
+        self.assertEqual(objects[1].content.getBoth(), (103, 1))
+        lazy = list(od.iterObjects(self.path, lazy=True))
+        self.assertEqual(lazy[2].depth, 9)
+
+    def testIndex(self):
+        od.writeObjects(self.path, sampleObjects())
+        with od.ObjectDumpReader(self.path) as reader:
+            self.assertTrue(reader.hasIndex())
+            self.assertEqual(reader.getIds(), [1, 3, 5, 9])
+            self.assertEqual(reader.getObject(9).depth, 9)
+            self.assertEqual(reader.getObject(4), None)
+            self.assertEqual(reader.getObject(10), None)
+
+    def testWithoutIndexAndMmap(self):
+        od.writeObjects(self.path, sampleObjects(), index=False)
+        with od.ObjectDumpReader(self.path) as reader:
+            self.assertFalse(reader.hasIndex())
+            self.assertRaises(od.ObjectDumpException, reader.getObject, 1)
+            self.assertEqual(len(list(reader.iterPbObjects())), 4)
+        data = StringIO()
+        od.writeObjects(data, sampleObjects())
+        data.seek(0)
+        self.assertEqual([obj.depth for obj in od.iterObjects(data)], [5, 3, 9, 1])
+
+    def testTruncated(self):
+        od.writeObjects(self.path, sampleObjects(), index=False)
+        with open(self.path, "r+b") as dumpFile:
+            dumpFile.truncate(os.path.getsize(self.path) - 10)
+        self.assertRaises(od.ObjectDumpException, list, od.iterObjects(self.path))
+        with open(self.path, "rb") as dumpFile:
+            data = StringIO(dumpFile.read())
+        self.assertRaises(od.ObjectDumpException, list, od.iterObjects(data))
+
+    def testEmptyFile(self):
+        self.assertRaises(od.ObjectDumpException, od.ObjectDumpReader, self.path)
+        with open(self.path, "rb") as dumpFile:
+            self.assertRaises(od.ObjectDumpException, od.ObjectDumpReader, dumpFile)
+
+    def testUnmappableFiles(self):
+        with gzip.GzipFile(self.path, "wb") as dumpFile:
+            od.writeObjects(dumpFile, sampleObjects())
+        with gzip.GzipFile(self.path, "rb") as dumpFile:
+            self.assertEqual([obj.depth for obj in od.iterObjects(dumpFile)], [5, 3, 9, 1])
+        od.writeObjects(self.path, sampleObjects())
+        (readEnd, writeEnd) = os.pipe()
+        with open(self.path, "rb") as dumpFile:
+            os.write(writeEnd, dumpFile.read())
+        os.close(writeEnd)
+        with os.fdopen(readEnd, "rb") as pipe:
+            with od.ObjectDumpReader(pipe) as reader:
+                self.assertFalse(reader.hasIndex())
+                self.assertEqual([obj.depth for obj in reader.iterObjects()], [5, 3, 9, 1])
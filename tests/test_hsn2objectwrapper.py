@@ -0,0 +1,372 @@
+# Copyright (c) NASK, NCSC
+#
+# This file is part of HoneySpider Network 2.1.
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import copy
+import gzip
+import mmap
+import os
+import pickle
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from hsn2_commons import hsn2objectwrapper as ow
+from hsn2_commons.hsn2dsadapter import HSN2DataStoreAdapter
+
+
+def sampleObject():
+    obj = ow.Object(7)
+    obj.addFlag("flag")
+    obj.addBool("active", True)
+    obj.addInt("depth", 3)
+    obj.addFloat("score", 0.5)
+    obj.addTime("creation_time", 1000)
+    obj.addString("url_original", u"http://example.com/")
+    obj.addBytes("content", 12, 1)
+    obj.addObject("parent", 5)
+    return obj
+
+
+class FakeDataStore(HSN2DataStoreAdapter):
+
+    def __init__(self):
+        HSN2DataStoreAdapter.__init__(self, "localhost:8080")
+        self.fetched = []
+
+    def getFile(self, job_id, event_id):
+        self.fetched.append((job_id, event_id))
+        return "contents of %d" % event_id
+
+
+class DerivedObject(ow.Object):
+    pass
+
+
+class DerivedLazyObject(ow.LazyObject):
+    pass
+
+
+class testHSN2ObjectWrapper(unittest.TestCase):
+
+    def assertSameObject(self, first, second):
+        self.assertEqual(first.getObjectId(), second.getObjectId())
+        self.assertEqual(first.getTypeStore(), second.getTypeStore())
+        for name in first.getTypeStore():
+            if name == "content":
+                self.assertEqual(getattr(first, name).getBoth(), getattr(second, name).getBoth())
+            else:
+                self.assertEqual(getattr(first, name), getattr(second, name))
+
+    def testRoundTrip(self):
+        obj = sampleObject()
+        self.assertSameObject(obj, ow.toObject(ow.fromObject(obj)))
+
+    def testAttributeAccess(self):
+        obj = sampleObject()
+        self.assertEqual(obj.depth, 3)
+        obj.depth = 4
+        self.assertEqual(obj.depth, 4)
+        self.assertEqual(obj.getTypeStore()["depth"], "INT")
+        del obj.depth
+        self.assertFalse(obj.isSet("depth"))
+        self.assertRaises(AttributeError, getattr, obj, "depth")
+        self.assertRaises(AttributeError, obj.removeAttribute, "depth")
+        obj.addFlag("parent")
+        self.assertEqual(obj.getTypeStore()["parent"], "EMPTY")
+        self.assertTrue(obj.parent is None)
+
+    def testPythonAttributes(self):
+        obj = sampleObject()
+        obj.note = "not sent"
+        self.assertEqual(obj.note, "not sent")
+        self.assertFalse(obj.isSet("note"))
+        self.assertFalse("note" in ow.toObject(ow.fromObject(obj)).getTypeStore())
+        obj.addInt("note", 2)
+        self.assertEqual((obj.note, obj.getTypeStore()["note"]), (2, "INT"))
+        obj.hint = 5
+        obj.setType("hint", "INT")
+        self.assertEqual(ow.toObject(ow.fromObject(obj)).hint, 5)
+
+        class Derived(ow.Object):
+
+            def __init__(self, ident):
+                self.extra = 1
+                ow.Object.__init__(self, ident)
+
+        derived = Derived(1)
+        derived.addInt("depth", 2)
+        derived.extra = derived.extra + 1
+        self.assertEqual((derived.extra, derived.depth, derived.getTypeStore().keys()), (2, 2, ["depth"]))
+
+        class DerivedLazy(ow.LazyObject):
+
+            def __init__(self, pbObject):
+                self.extra = 1
+                ow.LazyObject.__init__(self, pbObject)
+
+        lazy = DerivedLazy(ow.fromObject(sampleObject()))
+        self.assertEqual((lazy.extra, lazy.depth), (1, 3))
+        self.assertRaises(AttributeError, getattr, ow.LazyObject.__new__(ow.LazyObject), "depth")
+
+    def testTypeStoreIsLive(self):
+        obj = sampleObject()
+        types = obj.getTypeStore()
+        types["depth"] = "FLOAT"
+        del types["flag"]
+        self.assertEqual((obj.getTypeStore()["depth"], obj.isSet("flag")), ("FLOAT", False))
+        self.assertEqual(obj.internalStoreType, types)
+        self.assertRaises(KeyError, types.__getitem__, "flag")
+        obj.internalStoreType = {"depth": "INT", "content": "BYTES"}
+        self.assertEqual(sorted(obj.getTypeStore().items()), [("content", "BYTES"), ("depth", "INT")])
+        self.assertEqual(obj.url_original, u"http://example.com/")
+        self.assertFalse(obj.isSet("url_original"))
+        self.assertEqual(dict(ow.LazyObject(ow.fromObject(obj)).getTypeStore()), dict(types))
+
+    def testPickle(self):
+        obj = sampleObject()
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertSameObject(obj, pickle.loads(pickle.dumps(obj, protocol)))
+            lazy = ow.LazyObject(ow.fromObject(obj))
+            self.assertSameObject(obj, pickle.loads(pickle.dumps(lazy, protocol)))
+
+    def testLazyObjectAccess(self):
+        obj = sampleObject()
+        lazy = ow.LazyObject(ow.fromObject(obj))
+        self.assertTrue(lazy.isSet("depth"))
+        self.assertFalse(lazy.isSet("missing"))
+        self.assertEqual(lazy.depth, 3)
+        self.assertRaises(AttributeError, getattr, lazy, "missing")
+        self.assertSameObject(obj, lazy)
+
+    def testLazyObjectUnmodifiedIsNotConverted(self):
+        pbObject = ow.fromObject(sampleObject())
+        lazy = ow.LazyObject(pbObject)
+        self.assertTrue(ow.fromObject(lazy) is pbObject)
+
+    def testLazyObjectMaterializesOnModification(self):
+        obj = sampleObject()
+        lazy = ow.LazyObject(ow.fromObject(obj))
+        lazy.addInt("depth", 4)
+        lazy.removeAttribute("flag")
+        obj.addInt("depth", 4)
+        obj.removeAttribute("flag")
+        self.assertTrue(lazy.pbObject is None)
+        self.assertSameObject(obj, lazy)
+        self.assertSameObject(obj, ow.toObject(ow.fromObject(lazy)))
+
+    def testIterObjectsFromJSON(self):
+        (fd, path) = tempfile.mkstemp(".json")
+        os.write(fd, '{"id": 1, "attrs": [{"name": "url_original", "type": "STRING", "data_string": "a}{b"}]}\n'
+                     '{"id": 2, "attrs": [{"name": "content", "type": "BYTES", "data_bytes": {"key": 3, "store": 1}}]}\n'
+                     '{"attrs": []}')
+        os.close(fd)
+        try:
+            objects = list(ow.iterObjectsFromJSON(path, chunkSize=7))
+        finally:
+            os.remove(path)
+        self.assertEqual([obj.getObjectId() for obj in objects], [1, 2])
+        self.assertEqual(objects[0].url_original, "a}{b")
+        self.assertEqual(objects[1].content.getBoth(), (3, 1))
+
+    def testObjectsFromGzippedJSON(self):
+        data = StringIO()
+        for i in range(3):
+            # Each object in a separate gzip member, as when dumps are concatenated.
+            member = gzip.GzipFile(fileobj=data, mode="wb")
+            member.write('{"id": %d, "attrs": [{"name": "depth", "type": "INT", "data_int": %d}]}\n' % (i, i))
+            member.close()
+        data.seek(0)
+        objects = ow.toObjectsFromJSON(data)
+        self.assertFalse(data.closed)
+        self.assertEqual([(obj.getObjectId(), obj.depth) for obj in objects], [(0, 0), (1, 1), (2, 2)])
+        data.seek(0)
+        self.assertEqual(len(list(ow.iterObjectsFromJSON(data, chunkSize=5))), 3)
+
+    def testObjectsFromJSONParallel(self):
+        (fd, path) = tempfile.mkstemp(".json")
+        for i in range(50):
+            os.write(fd, '{"id": %d, "attrs": [{"name": "url_original", "type": "STRING", "data_string": "}{\\"id\\": %d}"}]}\n'
+                         % (i, i))
+        os.close(fd)
+        try:
+            offsets = ow.findDumpBoundaries(path, 200)
+            objects = list(ow.iterObjectsFromJSONParallel(path, processes=2, rangeSize=200))
+            unordered = list(ow.iterObjectsFromJSONParallel(path, processes=2, ordered=False, rangeSize=200))
+        finally:
+            os.remove(path)
+        self.assertTrue(len(offsets) > 10)
+        self.assertEqual([obj.getObjectId() for obj in objects], range(50))
+        self.assertEqual(sorted(obj.getObjectId() for obj in unordered), range(50))
+
+    def testObjectsFromJSONParallelError(self):
+        (fd, path) = tempfile.mkstemp(".json")
+        for i in range(50):
+            os.write(fd, '{"id": %d, "attrs": [%s]}\n' % (i, "}" if i == 25 else ""))
+        os.close(fd)
+        try:
+            for ordered in (True, False):
+                self.assertRaises(ValueError, list,
+                                  ow.iterObjectsFromJSONParallel(path, processes=2, ordered=ordered, rangeSize=100))
+        finally:
+            os.remove(path)
+
+    def testAttributeNamesShared(self):
+        pbObject = ow.fromObject(sampleObject())
+        first = ow.toObject(pbObject)
+        second = ow.toObject(ow.Object_pb2.ObjectData.FromString(pbObject.SerializeToString()))
+        fromJSON = ow.toObjectFromJSON('{"id": 1, "attrs": [{"name": "depth", "type": "INT", "data_int": 1}]}')
+        self.assertTrue(first._names[first._names.index("depth")] is second._names[second._names.index("depth")])
+        self.assertTrue(fromJSON._names[0] is first._names[first._names.index("depth")])
+
+    def testBoundReferences(self):
+        ds = FakeDataStore()
+        obj = sampleObject()
+        lazy = ow.LazyObject(ow.fromObject(obj))
+        obj.bindReferences(ds, 5)
+        lazy.bindReferences(ds, 5)
+        self.assertEqual(obj.content.read(), "contents of 12")
+        self.assertEqual(lazy.content.stream().read(), "contents of 12")
+        path = lazy.content.path()
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), "contents of 12")
+        self.assertEqual(ds.fetched, [(5, 12)])
+        ds.clearCache()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(pickle.loads(pickle.dumps(obj.content)).isBound(), False)
+        self.assertRaises(ow.BadValueException, ow.Reference(1, 1).read)
+        other = ow.Reference(13, 1).bind(object(), 5)
+        ow.unbindReferences(ds)
+        self.assertFalse(obj.content.isBound())
+        self.assertFalse(lazy.content.isBound())
+        self.assertTrue(other.isBound())
+        ow.unbindReferences()
+        self.assertFalse(other.isBound())
+        self.assertRaises(ow.BadValueException, lazy.content.stream)
+
+    def testIterResourceLists(self):
+        contexts = [{"id": i, "source": u"eval('%d')" % i, "eval": bool(i % 2)} for i in range(3)]
+        data = ow.toJSContextList(contexts).SerializeToString()
+        self.assertEqual(list(ow.iterJSContextList(data)), contexts)
+        self.assertEqual(list(ow.iterJSContextList(buffer(data))), contexts)
+        self.assertEqual(ow.fromJSContextList(StringIO(data)), contexts)
+        (fd, path) = tempfile.mkstemp()
+        # An unknown varint field before the list is skipped.
+        os.write(fd, "\x10\x05" + ow.toIpAddressList(["10.0.0.1", "10.0.0.2"]).SerializeToString())
+        os.close(fd)
+        try:
+            with open(path, "rb") as f:
+                self.assertEqual(list(ow.iterIpAddressList(f)), ["10.0.0.1", "10.0.0.2"])
+        finally:
+            os.remove(path)
+        self.assertEqual(list(ow.iterYaraMatchesList("")), [])
+        self.assertRaises(ow.BadValueException, list, ow.iterDnsList(ow.toDnsList(["a.pl"]).SerializeToString()[:-1]))
+
+    def testResourceListFromPosition(self):
+        data = ow.toIpAddressList(["10.0.0.1", "10.0.0.2"]).SerializeToString()
+        (fd, path) = tempfile.mkstemp()
+        os.write(fd, "HDR" + data)
+        os.close(fd)
+        try:
+            with open(path, "rb") as f:
+                f.read(3)
+                self.assertEqual(ow.fromIpAddressList(f), ["10.0.0.1", "10.0.0.2"])
+            with open(path, "rb") as f:
+                f.seek(len(data) + 3)
+                self.assertEqual(list(ow.iterIpAddressList(f)), [])
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                mapped.seek(3)
+                self.assertEqual(list(ow.iterIpAddressList(mapped)), ["10.0.0.1", "10.0.0.2"])
+                self.assertEqual(mapped[:3], "HDR")
+                # Like files, the mmap is closed by the from* functions.
+                self.assertEqual(ow.fromIpAddressList(mapped), ["10.0.0.1", "10.0.0.2"])
+            # Has a fileno, but of the compressed file.
+            packed = gzip.GzipFile(path, "wb")
+            packed.write(data)
+            packed.close()
+            packed = gzip.GzipFile(path, "rb")
+            self.assertEqual(ow.fromIpAddressList(packed), ["10.0.0.1", "10.0.0.2"])
+        finally:
+            os.remove(path)
+
+    def testResourceConverters(self):
+        behaviors = [{"description_text": "created file", "discovery_method": "hook"}, {}]
+        data = ow.toBehaviorList(behaviors).SerializeToString()
+        self.assertEqual(ow.fromBehaviorList(StringIO(data)),
+                         [{"description_text": u"created file", "discovery_method": u"hook"},
+                          {"description_text": u"", "discovery_method": u""}])
+        contexts = ow.toJSContextList([{"id": "3", "source": 7, "eval": "true"}])
+        self.assertEqual(ow.fromJSContextList(StringIO(contexts.SerializeToString())),
+                         [{"id": 3, "source": u"7", "eval": True}])
+        self.assertRaises(ow.BadValueException, ow.toJSContextList, [{"id": 1, "source": "", "eval": "maybe"}])
+        self.assertRaises(ow.BadValueException, ow.toJSContextList, [{"id": 1, "eval": True}])
+        converter = ow.getResourceConverter(ow.Resources_pb2.ProtocolEntries)
+        self.assertEqual(converter.decode(ow.toFilterList(["tcp", "udp"]).SerializeToString()), ["tcp", "udp"])
+
+    def testDumpsObjects(self):
+        obj = sampleObject()
+        other = ow.Object(8)
+        other.addInt("depth", 1)
+        lazy = ow.LazyObject(ow.fromObject(obj))
+        loaded = ow.loadsObjects(ow.dumpsObjects([obj, other, lazy, sampleObject()]))
+        self.assertEqual(len(loaded), 4)
+        for (expected, actual) in zip([obj, other, obj, obj], loaded):
+            self.assertSameObject(expected, actual)
+        self.assertTrue(isinstance(loaded[2], ow.LazyObject))
+        self.assertEqual(ow.loadsObjects(ow.dumpsObjects([])), [])
+
+    def testPickleKeepsClass(self):
+        derived = DerivedObject(3)
+        derived.addInt("depth", 1)
+        derived.note = "note"
+        lazy = DerivedLazyObject(ow.fromObject(derived))
+        lazy.note = "lazy note"
+        materialized = DerivedLazyObject(ow.fromObject(derived))
+        materialized.addInt("depth", 2)
+        for copied in (pickle.loads(pickle.dumps(derived, 2)), copy.copy(derived), copy.deepcopy(derived)):
+            self.assertEqual(type(copied), DerivedObject)
+            self.assertEqual((copied.depth, copied.note), (1, "note"))
+        for copied in (pickle.loads(pickle.dumps(lazy, 2)), copy.copy(lazy)):
+            self.assertEqual(type(copied), DerivedLazyObject)
+            self.assertEqual((copied.depth, copied.note), (1, "lazy note"))
+        copied = pickle.loads(pickle.dumps(materialized, 2))
+        self.assertEqual((type(copied), copied.pbObject, copied.depth), (DerivedLazyObject, None, 2))
+
+    def testCopyIsIndependent(self):
+        obj = sampleObject()
+        clone = copy.copy(obj)
+        clone.addInt("extra", 1)
+        self.assertFalse(obj.isSet("extra"))
+        self.assertSameObject(obj, pickle.loads(pickle.dumps(obj, 2)))
+
+    def testClone(self):
+        template = sampleObject()
+        first = template.clone(1)
+        second = template.clone(2)
+        self.assertTrue(first._names is second._names)
+        first.addString("referrer", "http://a.pl/")
+        second.setValue("depth", 5)
+        second.content.setKey(99)
+        template.removeAttribute("flag")
+        self.assertEqual((first.getObjectId(), first.depth, first.content.getKey(), first.isSet("flag")), (1, 3, 12, True))
+        self.assertEqual((second.depth, second.content.getKey(), second.isSet("referrer")), (5, 99, False))
+        self.assertEqual((template.depth, template.content.getKey()), (3, 12))
+        for obj in (first, second, template, template.clone(3), ow.LazyObject(ow.fromObject(first)).clone(4)):
+            self.assertSameObject(obj, ow.toObject(ow.fromObject(obj)))
+        third = template.clone()
+        third.content.setKey(7)
+        self.assertEqual(ow.toObject(ow.fromObject(third)).content.getKey(), 7)
@@ -0,0 +1,372 @@
+# Copyright (c) NASK, NCSC
+#
+# This file is part of HoneySpider Network 2.1.
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import unittest
+
+from hsn2_commons import hsn2enumwrapper as enumwrap
+from hsn2_commons import hsn2objectwrapper as ow
+from hsn2_commons import hsn2osadapter
+from hsn2_commons.hsn2bus import BusTimeoutException
+from hsn2_commons.hsn2osadapter import CompiledQuery, HSN2ObjectStoreAdapter, ObjectStoreException
+from hsn2_commons.hsn2osadapter import QueryStructure, RetryPolicy
+from hsn2_commons.hsn2ostracer import ObjectStoreTracer
+from hsn2_protobuf import ObjectStore_pb2
+
+
+class FakeClock(object):
+    '''
+    Replaces the time module in hsn2osadapter. Time only passes when FakeBus reports a timeout.
+    '''
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+clock = FakeClock()
+
+
+class FakeBus(object):
+    '''
+    Bus replaying a script of replies. Each entry is either None (the wait times out)
+    or the index of the published message that is answered.
+    '''
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.published = []
+        self.waits = []
+        self.publishedAtWait = []
+        self.shardKeys = []
+        self.abandoned = set()
+
+    def publishCommand(self, dest, mtype, command, shardKey=None):
+        corrId = "%s-%d" % (mtype, len(self.published))
+        self.published.append(corrId)
+        self.shardKeys.append(shardKey)
+        return corrId
+
+    def awaitResponse(self, dest, corrIds, timeout):
+        self.waits.append(timeout)
+        self.publishedAtWait.append(len(self.published))
+        answer = self.script.pop(0)
+        if answer is None:
+            clock.now = clock.now + timeout
+            raise BusTimeoutException()
+        corrId = self.published[answer]
+        assert corrId in corrIds
+        objResp = ObjectStore_pb2.ObjectResponse()
+        objResp.objects.append(answer)
+        return corrId, "ObjectResponse", objResp.SerializePartialToString()
+
+    def abandonResponses(self, corrIds):
+        self.abandoned.update(corrIds)
+
+
+class StoreBus(FakeBus):
+    '''
+    Bus answering GET and QUERY requests from a dict mapping job ids to lists of objects.
+    The oldest request awaiting a reply is answered first.
+    '''
+
+    def __init__(self, jobs):
+        FakeBus.__init__(self, [])
+        self.jobs = jobs
+        self.requests = []
+        self.answered = set()
+
+    def publishCommand(self, dest, mtype, command, shardKey=None):
+        self.requests.append(ObjectStore_pb2.ObjectRequest.FromString(command))
+        return FakeBus.publishCommand(self, dest, mtype, command, shardKey)
+
+    def requestsOfType(self, reqType):
+        return [objReq for objReq in self.requests
+                if enumwrap.getName(objReq, "RequestType", objReq.type) == reqType]
+
+    def awaitResponse(self, dest, corrIds, timeout):
+        self.waits.append(timeout)
+        self.publishedAtWait.append(len(self.published))
+        index = min(self.published.index(corrId) for corrId in corrIds if corrId not in self.answered)
+        self.answered.add(self.published[index])
+        objReq = self.requests[index]
+        objects = dict((obj.getObjectId(), obj) for obj in self.jobs.get(objReq.job, []))
+        objResp = ObjectStore_pb2.ObjectResponse()
+        if enumwrap.getName(objReq, "RequestType", objReq.type) == "GET":
+            objResp.type = enumwrap.getValue(objResp, "ResponseType", "SUCCESS_GET")
+            for ident in objReq.objects:
+                if ident in objects:
+                    objResp.data.add().CopyFrom(ow.fromObject(objects[ident]))
+                else:
+                    objResp.missing.append(ident)
+        else:
+            objResp.type = enumwrap.getValue(objResp, "ResponseType", "SUCCESS_QUERY")
+            for (ident, obj) in sorted(objects.items()):
+                if all(self.matches(obj, query) for query in objReq.query):
+                    objResp.objects.append(ident)
+        return self.published[index], "ObjectResponse", objResp.SerializeToString()
+
+    def matches(self, obj, query):
+        attrs = dict((attr.name, attr) for attr in ow.fromObject(obj).attrs)
+        if enumwrap.getName(query, "QueryType", query.type) == "BY_ATTR_NAME":
+            found = query.attr_name in attrs
+        else:
+            found = attrs.get(query.attr_name) == query.attr_value
+        return found != query.negate
+
+
+def timeoutEarly(bus, dest, corrIds, timeout):
+    if bus.script[0] is None:
+        bus.script.pop(0)
+        bus.waits.append(timeout)
+        clock.now = clock.now + timeout / 2.0
+        raise BusTimeoutException()
+    return FakeBus.awaitResponse(bus, dest, corrIds, timeout)
+
+
+def makeObject(ident, parent=None, flag=False):
+    obj = ow.Object(ident)
+    if parent is not None:
+        obj.addObject("parent", parent)
+    if flag:
+        obj.addFlag("flag")
+    return obj
+
+
+def makeRequest(reqType):
+    objReq = ObjectStore_pb2.ObjectRequest()
+    objReq.job = 1
+    objReq.type = enumwrap.getValue(objReq, "RequestType", reqType)
+    return objReq
+
+
+class testHSN2ObjectStoreAdapter(unittest.TestCase):
+
+    def setUp(self):
+        hsn2osadapter.time = clock
+
+    def tearDown(self):
+        hsn2osadapter.time = time
+
+    def testDefaultSingleTry(self):
+        bus = FakeBus([None])
+        osa = HSN2ObjectStoreAdapter(bus)
+        self.assertRaises(ObjectStoreException, osa.sendRequest, makeRequest("GET"))
+        self.assertEqual(bus.waits, [600])
+        self.assertEqual(bus.abandoned, set(bus.published))
+
+    def testResendWithBackoff(self):
+        bus = FakeBus([None, None, 2])
+        osa = HSN2ObjectStoreAdapter(bus, RetryPolicy(maxTries=3, timeout=1, backoff=2))
+        osa.sendRequest(makeRequest("GET"))
+        self.assertEqual(bus.waits, [1, 2, 4])
+        self.assertEqual(bus.abandoned, set(bus.published[:2]))
+
+    def testLateReplyToEarlierTryAccepted(self):
+        bus = FakeBus([None, 0])
+        osa = HSN2ObjectStoreAdapter(bus, RetryPolicy(maxTries=2, timeout=1))
+        osa.sendRequest(makeRequest("QUERY"))
+        self.assertEqual(len(bus.published), 2)
+        self.assertEqual(bus.abandoned, set(bus.published[1:]))
+
+    def testPipelinedRequestsAnsweredOutOfOrder(self):
+        bus = FakeBus([2, None, 0, 1])
+        osa = HSN2ObjectStoreAdapter(bus, RetryPolicy(maxTries=2, timeout=1))
+        replies = osa.sendRequests([makeRequest("GET"), makeRequest("GET"), makeRequest("QUERY")])
+        self.assertEqual(len(replies), 3)
+        self.assertEqual(len(bus.published), 5)
+        self.assertEqual(bus.abandoned, set(bus.published[3:]))
+
+    def testPutNotResent(self):
+        bus = FakeBus([None])
+        osa = HSN2ObjectStoreAdapter(bus, RetryPolicy(maxTries=3, timeout=1))
+        self.assertRaises(ObjectStoreException, osa.sendRequest, makeRequest("PUT"))
+        self.assertEqual(len(bus.published), 1)
+
+    def testHedgedRequest(self):
+        bus = FakeBus([None, 0])
+        osa = HSN2ObjectStoreAdapter(bus, RetryPolicy(maxTries=1, timeout=2, hedgeDelay=0.5))
+        osa.sendRequest(makeRequest("GET"))
+        self.assertEqual(bus.waits, [0.5, 1.5])
+
+    def testEarlyTimeoutWaitsAgain(self):
+        bus = FakeBus([None, 0])
+        osa = HSN2ObjectStoreAdapter(bus, RetryPolicy(maxTries=1, timeout=2))
+        bus.awaitResponse = lambda dest, corrIds, timeout: timeoutEarly(bus, dest, corrIds, timeout)
+        osa.sendRequest(makeRequest("GET"))
+        # Only half of the wait passed before the timeout, the request is still awaited rather than failed.
+        self.assertEqual(bus.waits, [2, 1])
+        self.assertEqual(len(bus.published), 1)
+        self.assertEqual(bus.abandoned, set(bus.published[1:]))
+
+    def testPutSplitIntoRequests(self):
+        bus = FakeBus([0, 1, 2])
+        osa = HSN2ObjectStoreAdapter(bus)
+        osa.maxRequestObjects = 2
+        objects = [ow.Object() for _ in range(5)]
+        for obj in objects:
+            obj.addFlag("flag")
+        header = makeRequest("PUT")
+        self.assertEqual([len(objReq.data) for objReq in osa.splitRequests(header, objects)], [2, 2, 1])
+        ids = osa.objectsPut(1, 1, objects)
+        self.assertEqual(len(bus.published), 3)
+        self.assertEqual(list(ids), [0, 1, 2])
+        self.assertEqual(type(ids), type(ObjectStore_pb2.ObjectResponse().objects))
+
+    def testPutAndUpdateWindow(self):
+        bus = FakeBus([1, 0, 2, 4, 3, 5])
+        osa = HSN2ObjectStoreAdapter(bus)
+        osa.maxRequestObjects = 1
+        osa.requestWindow = 2
+        ids = osa.objectsPut(1, 1, [ow.Object() for _ in range(3)])
+        self.assertEqual(list(ids), [0, 1, 2])
+        osa.objectsUpdate(1, [ow.Object(i + 1) for i in range(3)])
+        self.assertEqual(bus.publishedAtWait, [2, 3, 3, 5, 6, 6])
+
+    def testUpdateSplitBySize(self):
+        osa = HSN2ObjectStoreAdapter(FakeBus([]))
+        objects = []
+        for i in range(4):
+            obj = ow.Object(i + 1)
+            obj.addString("content", "x" * 100)
+            objects.append(obj)
+        osa.maxRequestBytes = 250
+        header = makeRequest("UPDATE")
+        self.assertEqual([len(objReq.data) for objReq in osa.splitRequests(header, objects)], [2, 2])
+        osa.maxRequestBytes = 50
+        self.assertEqual([len(objReq.data) for objReq in osa.splitRequests(header, objects)], [1, 1, 1, 1])
+
+    def testImportWindow(self):
+        bus = FakeBus([1, 0, 2])
+        osa = HSN2ObjectStoreAdapter(bus)
+        osa.maxRequestObjects = 1
+        objects = [ow.Object(i) for i in range(3)]
+        ids = osa.importObjects(1, 1, iter(objects), window=2)
+        self.assertEqual(ids, [0, 1, 2])
+        self.assertEqual(bus.publishedAtWait, [2, 3, 3])
+
+    def testMissingObjectsCached(self):
+        bus = FakeBus([])
+        osa = HSN2ObjectStoreAdapter(bus)
+        osa.rememberMissing(1, [10, 11])
+        self.assertEqual(osa.objectsGet(1, [10, 11]), [])
+        self.assertEqual(sorted(osa.missing), [10, 11])
+        self.assertEqual(len(bus.published), 0)
+        self.assertEqual(osa.getKnownMissing(2, [10]), set())
+        osa.forgetMissing(1, [10])
+        self.assertEqual(osa.getKnownMissing(1, [10, 11]), set([11]))
+
+    def testMissingObjectsExpire(self):
+        osa = HSN2ObjectStoreAdapter(FakeBus([]))
+        osa.missingTTL = -1
+        osa.rememberMissing(1, [10])
+        self.assertEqual(osa.getKnownMissing(1, [10]), set())
+
+    def testTracing(self):
+        tracer = ObjectStoreTracer()
+        osa = HSN2ObjectStoreAdapter(FakeBus([0, 1]), tracer=tracer)
+        osa.objectsGet(1, [5, 6])
+        osa.maxRequestObjects = 1
+        obj = ow.Object()
+        obj.addFlag("flag")
+        obj.addInt("depth", 1)
+        osa.objectsUpdate(1, [obj])
+        snapshot = tracer.snapshot()
+        self.assertEqual(sorted(snapshot), [("GET", "convert"), ("GET", "parse"), ("GET", "serialize"),
+                                            ("GET", "wire"), ("UPDATE", "convert"), ("UPDATE", "parse"),
+                                            ("UPDATE", "serialize"), ("UPDATE", "wire")])
+        self.assertEqual(snapshot[("GET", "serialize")]["objects"], 2)
+        self.assertEqual(snapshot[("UPDATE", "convert")]["attrs"], 2)
+        self.assertEqual(snapshot[("UPDATE", "wire")]["count"], 1)
+        self.assertTrue(tracer.report().startswith("type"))
+
+    def testShardKeys(self):
+        bus = FakeBus([0, 1, 2, 3])
+        osa = HSN2ObjectStoreAdapter(bus)
+        osa.objectsGet(7, [1])
+        osa.objectsUpdate(7, [ow.Object(1)])
+        osa.sharding = "roundrobin"
+        osa.objectsGet(7, [1])
+        osa.objectsUpdate(7, [ow.Object(1)])
+        self.assertEqual(bus.shardKeys, [7, 7, None, 7])
+
+    def testQueryIterChunks(self):
+        bus = StoreBus({1: [makeObject(i, flag=(i != 3)) for i in range(1, 7)]})
+        osa = HSN2ObjectStoreAdapter(bus)
+        query = QueryStructure(makeObject(None, flag=True))
+        chunks = list(osa.queryIter(1, [query], chunk=2))
+        self.assertEqual([[obj.getObjectId() for obj in objects] for objects in chunks], [[1, 2], [4, 5], [6]])
+        self.assertEqual(len(bus.requestsOfType("QUERY")), 1)
+        self.assertEqual([list(objReq.objects) for objReq in bus.requestsOfType("GET")], [[1, 2], [4, 5], [6]])
+        lazy = list(osa.queryIter(1, [query], chunk=10, lazy=True))
+        self.assertEqual(len(lazy), 1)
+        self.assertTrue(isinstance(lazy[0][0], ow.LazyObject))
+        self.assertEqual(list(osa.queryIter(2, [query])), [])
+        self.assertRaises(ValueError, list, osa.queryIter(1, [query], chunk=0))
+
+    def testCompiledQueryBoundToJob(self):
+        bus = StoreBus({1: [makeObject(1, flag=True), makeObject(2)], 2: [makeObject(3, flag=True)]})
+        osa = HSN2ObjectStoreAdapter(bus)
+        attributes = makeObject(None, flag=True)
+        compiled = CompiledQuery([QueryStructure(attributes)])
+        # The attributes are converted once, later changes don't affect the compiled query.
+        attributes.addInt("depth", 1)
+        self.assertEqual([objReq.job for objReq in (compiled.buildRequest(1), compiled.buildRequest(2))], [1, 2])
+        self.assertFalse(compiled.template.HasField("job"))
+        self.assertEqual(list(osa.query(1, compiled)), [1])
+        self.assertEqual(list(osa.query(2, compiled)), [3])
+        self.assertEqual(list(osa.query(1, [QueryStructure(attributes)])), [])
+        (first, second) = bus.requestsOfType("QUERY")[:2]
+        self.assertEqual([first.job, second.job], [1, 2])
+        self.assertEqual(first.query, second.query)
+        self.assertEqual([query.attr_name for query in first.query], ["flag"])
+
+    def testGraphUp(self):
+        # 1 <- 2 <- 3 <- 4 and 1 <- 5, objects point to their parents.
+        bus = StoreBus({1: [makeObject(1), makeObject(2, 1), makeObject(3, 2), makeObject(4, 3), makeObject(5, 1)]})
+        osa = HSN2ObjectStoreAdapter(bus)
+        found = osa.objectsGetGraph(1, [4, 5])
+        self.assertEqual(sorted(found), [1, 2, 3, 4, 5])
+        self.assertEqual(found[3].parent, 2)
+        self.assertEqual([sorted(objReq.objects) for objReq in bus.requests], [[4, 5], [1, 3], [2]])
+        self.assertEqual(sorted(osa.objectsGetGraph(1, [4], depth=1)), [3, 4])
+        self.assertEqual(sorted(osa.objectsGetGraph(1, [4], depth=0)), [4])
+        self.assertRaises(ValueError, osa.objectsGetGraph, 1, [4], "sideways")
+
+    def testGraphDown(self):
+        # 1 has children 2 and 3, 3 has the child 4.
+        bus = StoreBus({1: [makeObject(1), makeObject(2, 1), makeObject(3, 1), makeObject(4, 3)]})
+        osa = HSN2ObjectStoreAdapter(bus)
+        self.assertEqual(sorted(osa.objectsGetGraph(1, [1], "down")), [1, 2, 3, 4])
+        kinds = [enumwrap.getName(objReq, "RequestType", objReq.type) for objReq in bus.requests]
+        self.assertEqual(kinds, ["GET", "QUERY", "GET", "QUERY", "QUERY", "GET", "QUERY"])
+        self.assertEqual([sorted(objReq.objects) for objReq in bus.requestsOfType("GET")], [[1], [2, 3], [4]])
+        # The queries of a level are sent before any of their replies is awaited.
+        self.assertEqual(bus.publishedAtWait[3:5], [5, 5])
+        self.assertEqual(sorted(osa.objectsGetGraph(1, [1], "down", depth=1)), [1, 2, 3])
+        self.assertEqual(sorted(osa.objectsGetGraph(1, [3, 9], "down")), [3, 4])
+
+
+    def testGraphDownWindow(self):
+        bus = StoreBus({1: [makeObject(1)] + [makeObject(i, 1) for i in range(2, 7)]})
+        osa = HSN2ObjectStoreAdapter(bus)
+        osa.requestWindow = 2
+        osa.objectsGetGraph(1, [1], "down", depth=2)
+        # GET 1, QUERY 1, GET 2-6, then 5 queries of which at most 2 await a reply.
+        self.assertEqual(bus.publishedAtWait, [1, 2, 3, 5, 6, 7, 8, 8])